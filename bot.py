@@ -1,8 +1,10 @@
 import os
+import time
+import hashlib
 import logging
 import asyncio
+from functools import partial
 from telegram import InputMediaVideo, Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
-from telegram.constants import ChatMemberStatus
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -10,18 +12,36 @@ from telegram.ext import (
     filters,
     ContextTypes,
     CallbackQueryHandler,
+    ChatMemberHandler,
 )
 from config import config
 import sys
 from updater import update_from_upstream
-from telegram.error import BadRequest, RetryAfter
+from telegram.error import BadRequest
 import random
 from database import (
-    save_thumbnail, get_thumbnail, delete_thumbnail, has_thumbnail,
-    ban_user, unban_user, is_user_banned, get_total_users, get_banned_users_count, get_stats,
+    init_db, close_db, flush_writes,
+    save_thumbnail, delete_thumbnail,
+    ban_user, unban_user, is_user_banned, get_banned_users_count, get_stats,
+    get_cache_stats, get_user_profile, get_index_stats, list_broadcast_jobs, count_audience, get_db_health,
+    get_reachability, mark_reachable, get_cached_result, cache_result, forget_cached_result,
+    get_result_cache_stats,
     format_log_message, log_new_user, log_user_banned, log_user_unbanned,
     log_thumbnail_set, log_thumbnail_removed
 )
+from invalidation import bus
+from cache import TTLCache, single_flight
+from scheduler import video_scheduler, QueueFull, Batcher, LatencyStats, VIDEO_BATCH_WINDOW, MEDIA_GROUP_LIMIT
+from logpipe import LogPipeline
+from broadcast import (
+    BroadcastJob, report_progress, create_job, set_job_state, spawn_job, stop_jobs, resume_jobs_loop
+)
+from forcesub import (
+    is_member, remember_membership, get_membership_stats,
+    parse_channel_id, is_channel, record_member_event, enable_event_feed,
+    verified_users, is_verified, set_verified,
+    get_channel_info, get_join_link, start_invite_pool, stop_invite_pool
+)
 from telegram import MessageEntity
 
 def bold_entities(text: str):
@@ -44,11 +64,22 @@ if not TOKEN:
 
 OWNER_ID = int(os.environ.get("OWNER_ID", "0"))
 FORCE_SUB_CHANNEL_ID = os.environ.get("FORCE_SUB_CHANNEL_ID")
+# Parsed once: numeric chat id, or the @username as configured
+FORCE_SUB_CHANNEL = parse_channel_id(FORCE_SUB_CHANNEL_ID) if FORCE_SUB_CHANNEL_ID else None
 FORCE_SUB_BANNER_URL = os.environ.get("FORCE_SUB_BANNER_URL")
 HOME_MENU_BANNER_URL = os.environ.get("HOME_MENU_BANNER_URL")
 OWNER_USERNAME = os.environ.get("OWNER_USERNAME", "")
 LOG_CHANNEL_ID = os.environ.get("LOG_CHANNEL_ID")
 
+# Rate-limited, batching writer for the log channel (see logpipe.py)
+log_pipeline = LogPipeline(LOG_CHANNEL_ID)
+
+# "direct" sends the covered video in one send_video call and only shows a placeholder
+# when that takes longer than VIDEO_DIRECT_TIMEOUT seconds or fails (then the placeholder
+# is edited into the video); "edit" always sends the placeholder first and edits it
+VIDEO_DELIVERY_MODE = os.environ.get("VIDEO_DELIVERY_MODE", "direct").strip().lower()
+VIDEO_DIRECT_TIMEOUT = float(os.environ.get("VIDEO_DIRECT_TIMEOUT", "3"))
+
 # Fallback: collect images from ./ui/ and pick randomly when showing banner
 FALLBACK_BANNER = None
 UI_BANNERS = []
@@ -77,27 +108,13 @@ def get_force_banner():
     return FALLBACK_BANNER
 
 
-# In-memory set of users who completed the verify step
-verified_users = set()
-
 """═════════════════ LOGGING HELPER ═════════════════"""
-async def send_log(context: ContextTypes.DEFAULT_TYPE, log_message: str) -> bool:
-    """Send log message to log channel"""
+def send_log(context: ContextTypes.DEFAULT_TYPE, log_message: str, important: bool = False) -> bool:
+    """Queue log message for the log channel; returns at once, the log pipeline sends it"""
     if not LOG_CHANNEL_ID:
         logger.debug("LOG_CHANNEL_ID not configured")
         return False
-    
-    try:
-        await context.bot.send_message(
-            chat_id=LOG_CHANNEL_ID,
-            text=log_message,
-            parse_mode="HTML"
-        )
-        logger.debug(f"✅ Log sent to channel {LOG_CHANNEL_ID}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error sending log to channel: {e}")
-        return False
+    return log_pipeline.post(log_message, important=important)
 
 
 """--------------------HELPER FUNCTIONS--------------------"""
@@ -147,21 +164,21 @@ async def send_or_edit(update: Update, text, reply_markup=None, force_banner=Non
             )
 
 
-async def get_invite_link(bot, chat_id):
-    """Create or return a chat invite link with rate-limit retry handling."""
-    try:
-        link_obj = await bot.create_chat_invite_link(chat_id=chat_id, member_limit=1)
-        # Different objects may expose either 'invite_link' attribute or be a string
-        return getattr(link_obj, "invite_link", link_obj)
-    except RetryAfter as e:
-        # python-telegram-bot RetryAfter provides `retry_after` in seconds
-        secs = getattr(e, "retry_after", None) or 30
-        logger.info(f"Rate limited while creating invite link: sleeping {secs}s")
-        await asyncio.sleep(secs)
-        return await get_invite_link(bot, chat_id)
-    except Exception as e:
-        logger.error(f"get_invite_link failed: {e}")
-        return None
+def format_db_health() -> str:
+    """Database connection and invalidation bus summary for status screens"""
+    health = get_db_health()
+    icon = "🟢" if health["state"] == "connected" else "🔴"
+    line = f"🗄 ᴅᴀᴛᴀʙᴀsᴇ: {icon} {health['backend']} – {health['state']} sɪɴᴄᴇ {health['since']:%H:%M:%S}"
+    if health["state"] != "connected" and health["last_error"]:
+        line += f"\n<code>{health['last_error'][:80]}</code>"
+    bus_stats = bus.stats()
+    line += (
+        f"\n📡 ɪɴᴠᴀʟɪᴅᴀᴛɪᴏɴ: {bus_stats['transport']} – "
+        f"{bus_stats['published']} sᴇɴᴛ / {bus_stats['received']} ʀᴇᴄᴇɪᴠᴇᴅ"
+    )
+    if bus_stats["dropped"]:
+        line += f" / {bus_stats['dropped']} ᴅʀᴏᴘᴘᴇᴅ"
+    return line
 
 """--------------------ADMIN CHECK-----------------"""
 
@@ -189,7 +206,7 @@ async def check_admin_and_banned(update: Update, user_id_to_check: int = None) -
     if not admin:
         return False, None
     
-    if user_id_to_check and is_user_banned(user_id_to_check):
+    if user_id_to_check and await is_user_banned(user_id_to_check):
         return True, "banned"  # User is admin and target is banned
     return True, None
 
@@ -212,91 +229,33 @@ async def check_force_sub(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return True
 
     # If user already verified through verify button, verify they're still a member
-    if user_id in verified_users:
-        logger.info(f"🔍 User {user_id} is cached - checking if still a member...")
+    if await is_verified(user_id):
+        logger.debug(f"🔍 User {user_id} is cached - checking if still a member...")
         
         try:
-            channel_id_str = str(FORCE_SUB_CHANNEL_ID).strip()
-            
-            # Parse channel ID
-            try:
-                if channel_id_str.startswith("-"):
-                    channel_id = int(channel_id_str)
-                else:
-                    try:
-                        channel_id = int(channel_id_str)
-                    except ValueError:
-                        channel_id = channel_id_str
-            except Exception:
-                channel_id = channel_id_str
-            
-            # Check current membership status
-            member = await context.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            
-            # If still a member, allow access
-            if member.status in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
-                logger.info(f"✅ User {user_id} is still a member - access granted")
+            # Check current membership status (cached for MEMBERSHIP_TTL)
+            if await is_member(context.bot, FORCE_SUB_CHANNEL, user_id):
+                logger.debug(f"✅ User {user_id} is still a member - access granted")
                 return True
             
-            # If no longer a member, remove from cache and show join prompt
-            logger.warning(f"⚠️ User {user_id} left the channel - removing from cache")
-            verified_users.discard(user_id)
+            # If no longer a member, revoke verification and show join prompt
+            logger.warning(f"⚠️ User {user_id} left the channel - revoking verification")
+            await set_verified(user_id, False)
             
         except Exception as e:
             logger.warning(f"Could not verify membership for cached user {user_id}: {e}")
-            # On error, remove from cache to be safe
-            verified_users.discard(user_id)
+            # On error, show the prompt this time but keep the stored verification
+            verified_users.pop(user_id)
     
     logger.info(f"🔒 User {user_id} not verified or left channel - showing join prompt")
 
     # User not verified - show join prompt
     try:
-        channel_id_str = str(FORCE_SUB_CHANNEL_ID).strip()
-        logger.info(f"📌 Channel config: {channel_id_str}")
-        
-        # Parse channel ID
-        try:
-            if channel_id_str.startswith("-"):
-                channel_chat_id = int(channel_id_str)
-            else:
-                try:
-                    channel_chat_id = int(channel_id_str)
-                except ValueError:
-                    channel_chat_id = channel_id_str
-        except Exception as parse_err:
-            logger.error(f"❌ Channel ID parse error: {parse_err}")
-            channel_chat_id = channel_id_str
-
-        # Get channel info
+        # Channel name and join link come from the cached metadata and invite pool
         try:
-            logger.info(f"📍 Getting chat info for {channel_chat_id}")
-            chat = await context.bot.get_chat(channel_chat_id)
-            channel_name = chat.title or chat.username or "Channel"
-            logger.info(f"✅ Got chat info: {channel_name}")
-            
-            # Get invite link
-            invite_link = None
-            if chat.username:
-                invite_link = f"https://t.me/{chat.username}"
-            elif hasattr(chat, 'invite_link') and chat.invite_link:
-                invite_link = chat.invite_link
-            
-            # Try to create invite link if doesn't exist
-            if not invite_link:
-                try:
-                    link_obj = await context.bot.create_chat_invite_link(
-                        chat_id=channel_chat_id, 
-                        member_limit=1
-                    )
-                    invite_link = link_obj.invite_link
-                except Exception as link_error:
-                    logger.warning(f"Could not create invite link: {link_error}")
-                    # Fallback to direct channel link
-                    if str(channel_chat_id).startswith('-100'):
-                        invite_link = f"https://t.me/c/{str(channel_chat_id)[4:]}"
-                    else:
-                        invite_link = f"https://t.me/{channel_chat_id}"
-            
+            channel = await get_channel_info(context.bot, FORCE_SUB_CHANNEL)
+            channel_name = channel["name"]
+            invite_link = await get_join_link(context.bot, FORCE_SUB_CHANNEL, user_id)
         except Exception as e:
             logger.error(f"Could not get chat info: {e}")
             return True  # Fail open
@@ -388,6 +347,26 @@ async def check_force_sub(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 
+async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the membership index current from force-sub channel join/leave events"""
+    change = update.chat_member
+    if not FORCE_SUB_CHANNEL or not is_channel(change.chat, FORCE_SUB_CHANNEL):
+        return
+
+    user_id = change.new_chat_member.user.id
+    joined = record_member_event(user_id, change.new_chat_member.status)
+    bus.publish("membership", user_id, {"joined": joined})
+    logger.info(f"{'📥' if joined else '📤'} User {user_id} {'joined' if joined else 'left'} the force-sub channel")
+
+
+def _on_membership_changed(user_id: int, data: dict) -> None:
+    # Join/leave event delivered to another worker
+    remember_membership(user_id, bool(data.get("joined")))
+
+
+bus.subscribe("membership", _on_membership_changed)
+
+
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback query with proper force-sub verification"""
     query = update.callback_query
@@ -412,43 +391,20 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         try:
-            # Parse channel ID - make sure we handle it as string first
-            channel_id_str = str(FORCE_SUB_CHANNEL_ID).strip()
-            logger.info(f"📌 Channel ID string: {channel_id_str}")
-            
-            # Try to convert to int
-            try:
-                if channel_id_str.startswith("-"):
-                    channel_id = int(channel_id_str)
-                else:
-                    # Try as int first, otherwise keep as string
-                    try:
-                        channel_id = int(channel_id_str)
-                    except ValueError:
-                        channel_id = channel_id_str
-            except Exception as parse_error:
-                logger.error(f"❌ Failed to parse channel ID: {parse_error}")
-                channel_id = channel_id_str
-            
-            logger.info(f"🔎 Checking membership for user {user_id} in channel {channel_id}")
+            logger.info(f"🔎 Checking membership for user {user_id} in channel {FORCE_SUB_CHANNEL}")
             
-            # Direct membership check
+            # Direct membership check; the user just joined, so never trust the cache here
             try:
-                member = await context.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-                logger.info(f"📊 Member status: {member.status}")
+                joined = await is_member(context.bot, FORCE_SUB_CHANNEL, user_id, use_cache=False)
             except Exception as member_error:
                 logger.error(f"❌ Error checking membership: {member_error}")
                 await query.answer("❌ ᴄʜᴀɴɴᴇʟ ᴄʜᴇᴄᴋ ꜰᴀɪʟᴇᴅ! ᴛʀʏ ᴀɢᴀɪɴ ʟᴀᴛᴇʀ.", show_alert=True)
                 return
             
             # Check if user is member
-            if member.status in (
-                ChatMemberStatus.MEMBER,
-                ChatMemberStatus.ADMINISTRATOR,
-                ChatMemberStatus.OWNER
-            ):
-                verified_users.add(user_id)
-                logger.info(f"✅ User {user_id} verified successfully with status {member.status}")
+            if joined:
+                await set_verified(user_id, True)
+                logger.info(f"✅ User {user_id} verified successfully")
                 
                 # Show success alert
                 await query.answer("✅ ᴄʜᴀɴɴᴇʟ ᴠᴇʀɪꜰɪᴇᴅ sᴜᴄᴄᴇssꜰᴜʟʟʏ!", show_alert=False)
@@ -466,7 +422,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             # User not in channel yet
-            logger.warning(f"⚠️ User {user_id} not a member. Status: {member.status}")
+            logger.warning(f"⚠️ User {user_id} not a member yet")
             await query.answer("❌ ᴊᴏɪɴ ᴛʜᴇ ᴄʜᴀɴɴᴇʟ ꜰɪʀsᴛ!\n\nᴘʟᴇᴀsᴇ ᴊᴏɪɴ ᴛʜᴇ ᴄʜᴀɴɴᴇʟ ᴀɴᴅ ᴛʜᴇɴ ᴄʟɪᴄᴋ ᴠᴇʀɪꜰʏ.", show_alert=True)
             return
             
@@ -496,7 +452,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("❌ Unauthorized", show_alert=True)
             return
         await query.answer()
-        stats = get_stats()
+        stats = await get_stats()
         text = (
             "📊 ʙᴏᴛ sᴛᴀᴛɪsᴛɪᴄs\n\n"
             f"👥 ᴛᴏᴛᴀʟ ᴜsᴇʀs: {stats['total_users']}\n"
@@ -521,17 +477,20 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("❌ Unauthorized", show_alert=True)
             return
         await query.answer()
-        stats = get_stats()
+        stats = await get_stats()
         total_users = stats['total_users']
         banned_users = stats['banned_users']
         active_users = total_users - banned_users
+        reach = await get_reachability()
         
         text = (
             "👥 ᴜsᴇʀ ᴍᴀɴᴀɢᴇᴍᴇɴᴛ\n\n"
             f"📊 ᴛᴏᴛᴀʟ ᴜsᴇʀs: {total_users}\n"
             f"✅ ᴀᴄᴛɪᴠᴇ ᴜsᴇʀs: {active_users}\n"
             f"🚫 ʙᴀɴɴᴇᴅ ᴜsᴇʀs: {banned_users}\n\n"
-            f"📈 ʙᴀɴ ʀᴀᴛᴇ: {(banned_users/total_users*100):.1f}%"
+            f"📈 ʙᴀɴ ʀᴀᴛᴇ: {(banned_users/total_users*100):.1f}%\n\n"
+            f"📶 ʀᴇᴀᴄʜᴀʙʟᴇ: {reach['reachable']} ({reach['reachable_ratio']*100:.1f}%)\n"
+            f"📵 ʙʟᴏᴄᴋᴇᴅ/ᴅᴇʟᴇᴛᴇᴅ: {reach['unreachable']}"
         )
         back_kb = InlineKeyboardMarkup([
             [InlineKeyboardButton("⬅️ Back", callback_data="admin_back")]
@@ -565,6 +524,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         except ImportError:
             text = "⏱️ <b>Bot Status</b>\n\n🟢 Status: <b>Online</b>"
+        text += "\n\n" + format_db_health()
         
         back_kb = InlineKeyboardMarkup([
             [InlineKeyboardButton("⬅️ Back", callback_data="admin_back")]
@@ -609,10 +569,35 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         await query.answer()
         text = "📢 ʙʀᴏᴀᴅᴄᴀsᴛ ᴍᴇssᴀɢᴇ\n\nꜱᴇɴᴅ ᴍᴇssᴀɢᴇ ᴛᴏ ʙʀᴏᴀᴅᴄᴀsᴛ ᴛᴏ ᴀʟʟ ᴜsᴇʀs"
-        back_kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("⬅️ Back", callback_data="admin_back")]
-        ])
-        await context.bot.send_message(chat_id=user_id, text=text, reply_markup=back_kb, parse_mode="HTML")
+        rows = []
+        jobs = await list_broadcast_jobs(limit=5)
+        if jobs:
+            text += "\n\n<b>Recent broadcasts:</b>"
+            for job in jobs:
+                text += f"\n• <code>{job['job_id']}</code> {job.get('state')} – {job.get('sent', 0)}/{job.get('total') or '?'}"
+                if job.get("state") in ("running", "paused"):
+                    rows += broadcast_controls(job["job_id"], job.get("state") == "paused").inline_keyboard
+        rows.append([InlineKeyboardButton("⬅️ Back", callback_data="admin_back")])
+        await context.bot.send_message(
+            chat_id=user_id, text=text, reply_markup=InlineKeyboardMarkup(rows), parse_mode="HTML"
+        )
+        return
+
+    if query.data.startswith(("bc_pause:", "bc_resume:", "bc_cancel:")):
+        if not is_admin(user_id):
+            await query.answer("❌ Unauthorized", show_alert=True)
+            return
+        action, job_id = query.data.split(":", 1)
+        state = {"bc_pause": "paused", "bc_resume": "running", "bc_cancel": "cancelled"}[action]
+        if not await set_job_state(job_id, state):
+            await query.answer("⚠️ Broadcast is not running on this worker", show_alert=True)
+            return
+        await query.answer(f"📢 Broadcast {state}")
+        if state != "cancelled":
+            try:
+                await query.message.edit_reply_markup(broadcast_controls(job_id, state == "paused"))
+            except Exception:
+                pass
         return
     
     if query.data == "admin_back":
@@ -784,7 +769,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data == "submenu_thumbnails":
         await query.answer()
         uid = query.from_user.id
-        thumb_status = "✅ sᴀᴠᴇᴅ" if has_thumbnail(uid) else "❌ ɴᴏᴛ sᴀᴠᴇᴅ"
+        profile = await get_user_profile(uid)
+        thumb_status = "✅ sᴀᴠᴇᴅ" if profile["photo_id"] else "❌ ɴᴏᴛ sᴀᴠᴇᴅ"
         text = (
             "🖼️ <b>ᴛʜᴜᴍʙɴᴀɪʟ ᴍᴀɴᴀɢᴇʀ</b>\n\n"
             f"<b>ᴄᴜʀʀᴇɴᴛ sᴛᴀᴛᴜs:</b> {thumb_status}\n\n"
@@ -849,7 +835,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if query.data == "thumb_show":
         await query.answer()
-        photo_id = get_thumbnail(user_id)
+        photo_id = (await get_user_profile(user_id))["photo_id"]
         if photo_id:
             text = "👁️ ʏᴏᴜʀ ᴄᴜʀʀᴇɴᴛ ᴛʜᴜᴍʙɴᴀɪʟ\n\nᴛʜɪs ᴘʜᴏᴛᴏ ᴡɪʟʟ ʙᴇ ᴀᴘᴘʟɪᴇᴅ ᴛᴏ ʏᴏᴜʀ ᴠɪᴅᴇᴏs\nᴄʜᴀɴɢᴇ ɪᴛ ᴀɴʏᴛɪᴍᴇ ʙʏ ᴜᴘʟᴏᴀᴅɪɴɢ ᴀ ɴᴇᴡ ᴏɴᴇ"
             back_kb = InlineKeyboardMarkup([
@@ -886,7 +872,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if query.data == "thumb_delete":
         await query.answer()
-        if delete_thumbnail(user_id):
+        if await delete_thumbnail(user_id):
             text = "✅ ᴛʜᴜᴍʙɴᴀɪʟ ᴅᴇʟᴇᴛᴇᴅ\n\nʀᴇᴍᴏᴠᴇᴅ ꜰʀᴏᴍ sʏsᴛᴇᴍ. ᴜᴘʟᴏᴀᴅ ɴᴇᴡ ᴏɴᴇ ᴀɴʏᴛɪᴍᴇ"
         else:
             text = "⚠️ ɴᴏ ᴛʜᴜᴍʙɴᴀɪʟ ꜰᴏᴜɴᴅ\n\nꜱᴇɴᴅ ᴀ ᴘʜᴏᴛᴏ ᴛᴏ ᴄʀᴇᴀᴛᴇ ᴏɴᴇ"
@@ -1009,18 +995,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or "Unknown"
     first_name = update.effective_user.first_name or "User"
     
-    # Check if user is banned
-    if is_user_banned(user_id):
+    # Check if user is banned (in-memory set, no database read)
+    if await is_user_banned(user_id):
         await update.message.reply_text("🚫 ᴀᴄᴄᴇss ᴅᴇɴɪᴇᴅ\n\nʏᴏᴜʀ ᴀᴄᴄᴏᴜɴᴛ ʜᴀs ʙᴇᴇɴ ʀᴇsᴛʀɪᴄᴛᴇᴅ. ᴄᴏɴᴛᴀᴄᴛ sᴜᴘᴘᴏʀᴛ.", parse_mode="HTML")
         return
+
+    profile = await get_user_profile(user_id)
     
     # Log new user (if first time)
-    user_check = get_thumbnail(user_id)
-    if user_check is None:
+    if profile["photo_id"] is None:
         # New user - log it
         log_data = log_new_user(user_id, username, first_name)
         log_msg = format_log_message(user_id, username, log_data["action"], log_data.get("details", ""))
-        await send_log(context, log_msg)
+        send_log(context, log_msg)
     
     # Check force-sub first
     if not await check_force_sub(update, context):
@@ -1161,7 +1148,8 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     user_id = update.message.from_user.id
     # Show thumbnail status
-    thumb_status = "✅ sᴀᴠᴇᴅ & ʀᴇᴀᴅʏ" if has_thumbnail(user_id) else "❌ ɴᴏᴛ sᴀᴠᴇᴅ ʏᴇᴛ"
+    profile = await get_user_profile(user_id)
+    thumb_status = "✅ sᴀᴠᴇᴅ & ʀᴇᴀᴅʏ" if profile["photo_id"] else "❌ ɴᴏᴛ sᴀᴠᴇᴅ ʏᴇᴛ"
     
     text = (
         "⚙️ ʏᴏᴜʀ sᴇᴛᴛɪɴɢs\n\n"
@@ -1196,11 +1184,11 @@ async def remover(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     username = update.message.from_user.username or "Unknown"
     
-    if delete_thumbnail(user_id):
+    if await delete_thumbnail(user_id):
         # Log thumbnail removal
         log_data = log_thumbnail_removed(user_id, username)
         log_msg = format_log_message(user_id, username, log_data["action"])
-        await send_log(context, log_msg)
+        send_log(context, log_msg)
         
         return await update.message.reply_text("✅ ᴛʜᴜᴍʙɴᴀɪʟ ʀᴇᴍᴏᴠᴇᴅ\n\nᴅᴇʟᴇᴛᴇᴅ sᴜᴄᴄᴇssꜰᴜʟʟʏ. ᴜᴘʟᴏᴀᴅ ᴀ ɴᴇᴡ ᴏɴᴇ ᴀɴʏᴛɪᴍᴇ!", reply_to_message_id=update.message.message_id, parse_mode="HTML")
     await update.message.reply_text("⚠️ ɴᴏ ᴛʜᴜᴍʙɴᴀɪʟ ᴛᴏ ʀᴇᴍᴏᴠᴇ\n\nꜱᴇɴᴅ ᴀ ᴘʜᴏᴛᴏ ꜰɪʀsᴛ!", reply_to_message_id=update.message.message_id, parse_mode="HTML")
@@ -1211,18 +1199,19 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     username = update.message.from_user.username or "Unknown"
     photo_id = update.message.photo[-1].file_id
+    photo_unique_id = update.message.photo[-1].file_unique_id
     
     # Check if replacing
-    old_thumbnail = get_thumbnail(user_id)
-    is_replace = old_thumbnail is not None
+    profile = await get_user_profile(user_id)
+    is_replace = profile["photo_id"] is not None
     
-    save_thumbnail(user_id, photo_id)
+    await save_thumbnail(user_id, photo_id, photo_unique_id)
     logger.info(f"✅ Thumbnail saved to MongoDB for user {user_id}")
     
     # Log thumbnail action
     log_data = log_thumbnail_set(user_id, username, is_replace=is_replace)
     log_msg = format_log_message(user_id, username, log_data["action"])
-    await send_log(context, log_msg)
+    send_log(context, log_msg)
     
     action_text = "ᴜᴘᴅᴀᴛᴇᴅ" if is_replace else "sᴀᴠᴇᴅ"
     await update.message.reply_text("✅ ᴛʜᴜᴍʙɴᴀɪʟ " + action_text + "\n\nʀᴇᴀᴅʏ! sᴇɴᴅ ᴀɴʏ ᴠɪᴅᴇᴏ ᴛᴏ ᴀᴘᴘʟʏ ᴄᴏᴠᴇʀ", reply_to_message_id=update.message.message_id, parse_mode="HTML")
@@ -1231,12 +1220,122 @@ async def video_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_force_sub(update, context):
         return
     user_id = update.message.from_user.id
-    username = update.message.from_user.username or "No Username"
-    cover = get_thumbnail(user_id)
+    profile = await get_user_profile(user_id)
+    cover = profile["photo_id"]
     if not cover:
         return await update.message.reply_text("❌ ɴᴏ ᴛʜᴜᴍʙɴᴀɪʟ ꜰᴏᴜɴᴅ\n\nꜱᴇɴᴅ ᴀ ᴘʜᴏᴛᴏ ꜰɪʀsᴛ ᴛᴏ sᴀᴠᴇ ᴛʜᴜᴍʙɴᴀɪʟ", reply_to_message_id=update.message.message_id, parse_mode="HTML")
-    msg = await update.message.reply_text("⏳ ᴘʀᴏᴄᴇssɪɴɢ ᴠɪᴅᴇᴏ\n\nᴘʟᴇᴀsᴇ ᴡᴀɪᴛ ᴀ ꜰᴇᴡ sᴇᴄᴏɴᴅs", reply_to_message_id=update.message.message_id, parse_mode="HTML")
-    
+
+    # Albums, and videos following another one within the batch window, go out together
+    # as media groups: one API call for up to 10 videos instead of two per video
+    message = update.message
+    if message.media_group_id:
+        return video_batcher.add((user_id, message.media_group_id), message)
+    burst_key = (user_id, None)
+    if recent_videos.peek(user_id) or video_batcher.is_open(burst_key):
+        recent_videos.set(user_id, True)
+        return video_batcher.add(burst_key, message)
+    recent_videos.set(user_id, True)
+
+    # Same video, cover and caption as an earlier job: resend that output, no placeholder
+    key = result_key(message, profile)
+    cached = await get_cached_result(key)
+
+    # Jobs ahead of this one across all users; the scheduler takes turns between users.
+    # A queued job always gets a placeholder so the user sees their position.
+    ahead = video_scheduler.position(user_id)
+    msg = None
+    placeholder_time = 0.0
+    if (VIDEO_DELIVERY_MODE == "edit" and cached is None) or ahead:
+        started = time.monotonic()
+        status = "ᴘʟᴇᴀsᴇ ᴡᴀɪᴛ ᴀ ꜰᴇᴡ sᴇᴄᴏɴᴅs" if ahead == 0 else f"📋 ǫᴜᴇᴜᴇ ᴘᴏsɪᴛɪᴏɴ: #{ahead + 1}"
+        msg = await update.message.reply_text(f"⏳ ᴘʀᴏᴄᴇssɪɴɢ ᴠɪᴅᴇᴏ\n\n{status}", reply_to_message_id=update.message.message_id, parse_mode="HTML")
+        placeholder_time = time.monotonic() - started
+
+    try:
+        await video_scheduler.submit(
+            user_id, lambda: apply_cover(update, context, msg, cover, placeholder_time, key, cached)
+        )
+    except QueueFull:
+        text = "⚠️ ᴛᴏᴏ ᴍᴀɴʏ ᴠɪᴅᴇᴏs ɪɴ ǫᴜᴇᴜᴇ\n\nᴡᴀɪᴛ ꜰᴏʀ ʏᴏᴜʀ ᴘᴇɴᴅɪɴɢ ᴠɪᴅᴇᴏs ᴛᴏ ꜰɪɴɪsʜ"
+        if msg:
+            await msg.edit_text(text, parse_mode="HTML")
+        else:
+            await update.message.reply_text(text, reply_to_message_id=update.message.message_id, parse_mode="HTML")
+
+
+# Time spent in Telegram calls to deliver one covered video (queue wait excluded), per
+# path: "direct" (one send_video), "edit" (placeholder reply plus edit), "fallback"
+# (direct send failed, placeholder edited) and "cached" (earlier output resent)
+delivery_latency = LatencyStats()
+
+
+def result_key(message, profile: dict) -> str:
+    """Result cache key: the video, the cover and the caption, by content rather than file_id"""
+    cover = profile.get("photo_unique_id") or profile["photo_id"]
+    caption = hashlib.sha1((message.caption or "").encode()).hexdigest()[:16]
+    return f"{message.video.file_unique_id}:{cover}:{caption}"
+
+
+def output_ids(sent, cover: str) -> tuple:
+    """file_ids of the video and cover Telegram stored for a delivered message"""
+    video = getattr(sent, "video", None)
+    if video is None:
+        return None, None
+    covers = getattr(video, "cover", None)
+    return video.file_id, covers[-1].file_id if covers else cover
+
+
+async def send_direct(update: Update, context: ContextTypes.DEFAULT_TYPE, media: InputMediaVideo):
+    """
+    Reply with the covered video in one call. Returns (sent message, None) once delivered,
+    or (None, placeholder) with a message to edit the video into when the send failed.
+    """
+    send = asyncio.ensure_future(context.bot.send_video(
+        chat_id=update.effective_chat.id, video=media.media, caption=media.caption,
+        caption_entities=media.caption_entities or None, supports_streaming=True, cover=media.cover,
+        reply_to_message_id=update.message.message_id
+    ))
+    placeholder = None
+    done, _ = await asyncio.wait({send}, timeout=VIDEO_DIRECT_TIMEOUT)
+    if not done:
+        # Slow upload on Telegram's side: let the user know, but keep waiting for this send
+        # rather than starting a second one that could deliver the video twice
+        placeholder = await update.message.reply_text("⏳ ᴘʀᴏᴄᴇssɪɴɢ ᴠɪᴅᴇᴏ\n\nᴘʟᴇᴀsᴇ ᴡᴀɪᴛ ᴀ ꜰᴇᴡ sᴇᴄᴏɴᴅs", reply_to_message_id=update.message.message_id, parse_mode="HTML")
+
+    try:
+        sent = await send
+    except Exception as e:
+        logger.warning(f"⚠️ Direct video send failed, editing placeholder instead: {e}")
+        return None, placeholder or await update.message.reply_text("⏳ ᴘʀᴏᴄᴇssɪɴɢ ᴠɪᴅᴇᴏ\n\nᴘʟᴇᴀsᴇ ᴡᴀɪᴛ ᴀ ꜰᴇᴡ sᴇᴄᴏɴᴅs", reply_to_message_id=update.message.message_id, parse_mode="HTML")
+
+    if placeholder:
+        try:
+            await placeholder.delete()
+        except Exception:
+            pass
+    return sent, None
+
+
+async def send_cached(update: Update, context: ContextTypes.DEFAULT_TYPE, msg, media: InputMediaVideo, cached: dict):
+    """Deliver an earlier output by file_id; raises if Telegram no longer accepts it"""
+    media = InputMediaVideo(
+        media=cached["video"], caption=media.caption, caption_entities=media.caption_entities,
+        supports_streaming=True, cover=cached["cover"]
+    )
+    if msg is not None:
+        return await context.bot.edit_message_media(chat_id=update.effective_chat.id, message_id=msg.message_id, media=media)
+    return await context.bot.send_video(
+        chat_id=update.effective_chat.id, video=media.media, caption=media.caption,
+        caption_entities=media.caption_entities or None, supports_streaming=True, cover=media.cover,
+        reply_to_message_id=update.message.message_id
+    )
+
+
+async def apply_cover(update: Update, context: ContextTypes.DEFAULT_TYPE, msg, cover: str,
+                      placeholder_time: float = 0.0, key: str = None, cached: dict = None) -> None:
+    """Scheduled job: deliver the video with the user's cover, directly or by editing msg"""
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or "No Username"
     video = update.message.video.file_id
     
     # Get original caption and preserve it
@@ -1247,32 +1346,145 @@ async def video_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     media = InputMediaVideo(media=video, caption=new_caption,caption_entities=caption_entities, supports_streaming=True, cover=cover)
     
     try:
-        # Edit message with video and cover
-        await context.bot.edit_message_media(chat_id=update.effective_chat.id, message_id=msg.message_id, media=media)
+        started = time.monotonic()
+        sent = None
+        if cached is not None:
+            try:
+                sent = await send_cached(update, context, msg, media, cached)
+                delivery_latency.record("cached", time.monotonic() - started + placeholder_time)
+            except Exception as e:
+                logger.warning(f"⚠️ Cached result rejected, applying cover again: {e}")
+                forget_cached_result(key)
+                cached = None
+
+        if cached is None:
+            mode = "edit"
+            if msg is None:
+                mode = "direct"
+                sent, msg = await send_direct(update, context, media)
+                if msg is not None:
+                    mode = "fallback"
+
+            if msg is not None:
+                # Edit message with video and cover
+                sent = await context.bot.edit_message_media(chat_id=update.effective_chat.id, message_id=msg.message_id, media=media)
+            delivery_latency.record(mode, time.monotonic() - started + placeholder_time)
+
+            output_video, output_cover = output_ids(sent, cover)
+            if key and output_video:
+                await cache_result(key, output_video, output_cover)
         
-        # Forward video to log channel
+        # Forward video to log channel (queued; the user's reply never waits on it)
         if LOG_CHANNEL_ID:
-            try:
+            log_caption = (
+                f"🎥 <b>ᴠɪᴅᴇᴏ ᴘʀᴏᴄᴇssɪɴɢ ᴄᴏᴍᴘʟᴇᴛᴇᴅ</b>\n\n"
+                f"👤 ᴜsᴇʀ ɪᴅ: <code>{user_id}</code>\n"
+                f"📌 ᴜsᴇʀɴᴀᴍᴇ: @{username}\n"
+                f"📝 ᴄᴀᴘᴛɪᴏɴ: {original_caption or 'ɴᴏ ᴄᴀᴘᴛɪᴏɴ'}\n"
+                f"⏰ ᴛɪᴍᴇsᴛᴀᴍᴘ: {update.message.date}"
+            )
+            log_pipeline.post_media(lambda bot, chat_id: bot.send_video(
+                chat_id=chat_id,
+                video=video,
+                caption=log_caption,
+                supports_streaming=True,
+                thumbnail=cover,
+                parse_mode="HTML"
+            ))
+    except Exception as e:
+        await update.message.reply_text("❌ ᴘʀᴏᴄᴇssɪɴɢ ꜰᴀɪʟᴇᴅ\n\nᴇʀʀᴏʀ: " + str(e)[:50], parse_mode="HTML")
+
+
+# user_id -> True while the user's last video is less than VIDEO_BATCH_WINDOW seconds old
+recent_videos = TTLCache(maxsize=10000, ttl=VIDEO_BATCH_WINDOW)
+
+
+async def queue_video_batch(key: tuple, messages: list) -> None:
+    """Batcher flush: schedule one media-group job for an album or burst of videos"""
+    user_id = key[0]
+    first = messages[0]
+    status = None
+    ahead = video_scheduler.position(user_id)
+    if ahead:
+        # Only worth a message when the batch has to wait for its turn
+        status = await first.reply_text(
+            f"⏳ ᴘʀᴏᴄᴇssɪɴɢ {len(messages)} ᴠɪᴅᴇᴏs\n\n📋 ǫᴜᴇᴜᴇ ᴘᴏsɪᴛɪᴏɴ: #{ahead + 1}", parse_mode="HTML"
+        )
+
+    try:
+        await video_scheduler.submit(user_id, lambda: apply_cover_batch(messages, status))
+    except QueueFull:
+        text = "⚠️ ᴛᴏᴏ ᴍᴀɴʏ ᴠɪᴅᴇᴏs ɪɴ ǫᴜᴇᴜᴇ\n\nᴡᴀɪᴛ ꜰᴏʀ ʏᴏᴜʀ ᴘᴇɴᴅɪɴɢ ᴠɪᴅᴇᴏs ᴛᴏ ꜰɪɴɪsʜ"
+        if status:
+            await status.edit_text(text, parse_mode="HTML")
+        else:
+            await first.reply_text(text, parse_mode="HTML")
+
+
+async def apply_cover_batch(messages: list, status=None) -> None:
+    """Scheduled job: send a batch of videos back with the user's cover as media groups"""
+    first = messages[0]
+    bot = first.get_bot()
+    user_id = first.from_user.id
+    username = first.from_user.username or "No Username"
+
+    # Read at send time: the cover may have changed while the batch was queued
+    cover = (await get_user_profile(user_id))["photo_id"]
+    try:
+        if not cover:
+            await first.reply_text("❌ ɴᴏ ᴛʜᴜᴍʙɴᴀɪʟ ꜰᴏᴜɴᴅ\n\nꜱᴇɴᴅ ᴀ ᴘʜᴏᴛᴏ ꜰɪʀsᴛ ᴛᴏ sᴀᴠᴇ ᴛʜᴜᴍʙɴᴀɪʟ", parse_mode="HTML")
+            return
+
+        for start in range(0, len(messages), MEDIA_GROUP_LIMIT):
+            chunk = messages[start:start + MEDIA_GROUP_LIMIT]
+            media = [
+                InputMediaVideo(
+                    media=m.video.file_id, caption=m.caption or "", caption_entities=bold_entities(m.caption or ""),
+                    supports_streaming=True, cover=cover
+                )
+                for m in chunk
+            ]
+            await send_videos(bot, first.chat_id, media, reply_to_message_id=chunk[0].message_id)
+
+            # Log the batch to the log channel as one album too
+            if LOG_CHANNEL_ID:
                 log_caption = (
-                    f"🎥 <b>ᴠɪᴅᴇᴏ ᴘʀᴏᴄᴇssɪɴɢ ᴄᴏᴍᴘʟᴇᴛᴇᴅ</b>\n\n"
+                    f"🎥 <b>{len(chunk)} ᴠɪᴅᴇᴏs ᴘʀᴏᴄᴇssᴇᴅ</b>\n\n"
                     f"👤 ᴜsᴇʀ ɪᴅ: <code>{user_id}</code>\n"
                     f"📌 ᴜsᴇʀɴᴀᴍᴇ: @{username}\n"
-                    f"📝 ᴄᴀᴘᴛɪᴏɴ: {original_caption or 'ɴᴏ ᴄᴀᴘᴛɪᴏɴ'}\n"
-                    f"⏰ ᴛɪᴍᴇsᴛᴀᴍᴘ: {update.message.date}"
+                    f"⏰ ᴛɪᴍᴇsᴛᴀᴍᴘ: {chunk[0].date}"
                 )
-                await context.bot.send_video(
-                    chat_id=LOG_CHANNEL_ID,
-                    video=video,
-                    caption=log_caption,
-                    supports_streaming=True,
-                    thumbnail=cover,
-                    parse_mode="HTML"
-                )
-                logger.debug(f"✅ Video logged to channel for user {user_id}")
-            except Exception as e:
-                logger.error(f"❌ Error forwarding video to log channel: {e}")
+                log_media = [
+                    InputMediaVideo(
+                        media=m.video.file_id, caption=log_caption if i == 0 else None,
+                        parse_mode="HTML", supports_streaming=True, cover=cover
+                    )
+                    for i, m in enumerate(chunk)
+                ]
+                log_pipeline.post_media(partial(send_videos, media=log_media))
     except Exception as e:
-        await update.message.reply_text("❌ ᴘʀᴏᴄᴇssɪɴɢ ꜰᴀɪʟᴇᴅ\n\nᴇʀʀᴏʀ: " + str(e)[:50], parse_mode="HTML")
+        await first.reply_text("❌ ᴘʀᴏᴄᴇssɪɴɢ ꜰᴀɪʟᴇᴅ\n\nᴇʀʀᴏʀ: " + str(e)[:50], parse_mode="HTML")
+    finally:
+        if status:
+            try:
+                await status.delete()
+            except Exception:
+                pass
+
+
+async def send_videos(bot, chat_id: int, media: list, **kwargs) -> None:
+    """send_media_group, or send_video for a lone item (media groups need at least two)"""
+    if len(media) > 1:
+        await bot.send_media_group(chat_id=chat_id, media=media, **kwargs)
+        return
+    item = media[0]
+    await bot.send_video(
+        chat_id=chat_id, video=item.media, caption=item.caption, caption_entities=item.caption_entities or None,
+        parse_mode=item.parse_mode, supports_streaming=item.supports_streaming, cover=item.cover, **kwargs
+    )
+
+
+video_batcher = Batcher(queue_video_batch)
 
 
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1312,6 +1524,18 @@ async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Give time for message to be sent
         await asyncio.sleep(1)
         
+        # execv skips post_shutdown: stop the resumer so it cannot reclaim the jobs released
+        # next, checkpoint and release running broadcasts so the new process resumes them at
+        # once, send queued log events, then write out queued user updates and close the database
+        resumer = context.bot_data.pop("broadcast_resumer", None)
+        if resumer is not None:
+            resumer.cancel()
+            await asyncio.gather(resumer, return_exceptions=True)
+        await stop_jobs()
+        await log_pipeline.stop()
+        await flush_writes()
+        await close_db()
+
         # Restart the bot
         os.execv(sys.executable, [sys.executable] + sys.argv)
         
@@ -1397,7 +1621,7 @@ async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = int(args[1])
         reason = args[2] if len(args) > 2 else "No reason"
         
-        if ban_user(user_id, reason):
+        if await ban_user(user_id, reason):
             await update.message.reply_text(
                 "✅ ᴜsᴇʀ " + str(user_id) + " ʙᴀɴɴᴇᴅ\n"
                 f"📌 ʀᴇᴀsᴏɴ: {reason}",
@@ -1407,7 +1631,7 @@ async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Log ban action
             log_data = log_user_banned(user_id, "User", reason)
             log_msg = format_log_message(user_id, "User", log_data["action"], log_data.get("details", ""))
-            await send_log(context, log_msg)
+            send_log(context, log_msg, important=True)
         else:
             await update.message.reply_text("❌ ꜰᴀɪʟᴇᴅ ᴛᴏ ʙᴀɴ ᴜsᴇʀ")
     except ValueError:
@@ -1430,13 +1654,13 @@ async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         user_id = int(args[1])
-        if unban_user(user_id):
+        if await unban_user(user_id):
             await update.message.reply_text("✅ ᴜsᴇʀ " + str(user_id) + " ᴜɴʙᴀɴɴᴇᴅ")
             
             # Log unban action
             log_data = log_user_unbanned(user_id, "User")
             log_msg = format_log_message(user_id, "User", log_data["action"])
-            await send_log(context, log_msg)
+            send_log(context, log_msg, important=True)
         else:
             await update.message.reply_text("❌ ꜰᴀɪʟᴇᴅ ᴛᴏ ᴜɴʙᴀɴ ᴜsᴇʀ")
     except ValueError:
@@ -1450,16 +1674,64 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_admin(update):
         return
     
-    stats = get_stats()
+    stats = await get_stats()
+    reach = await get_reachability()
+    cache_stats = get_cache_stats()
+    member_stats = get_membership_stats()
+    flight_stats = single_flight.stats()
+    queue_stats = video_scheduler.stats()
+    batch_stats = video_batcher.stats()
+    delivery_stats = delivery_latency.stats()
+    result_stats = get_result_cache_stats()
+    log_stats = log_pipeline.stats()
     text = (
         "📊 ʙᴏᴛ sᴛᴀᴛɪsᴛɪᴄs\n\n"
         f"👥 ᴛᴏᴛᴀʟ ᴜsᴇʀs: {stats['total_users']}\n"
         f"🚫 ʙᴀɴɴᴇᴅ ᴜsᴇʀs: {stats['banned_users']}\n"
-        f"🖼 ᴜsᴇʀs ᴡɪᴛʜ ᴛʜᴜᴍʙɴᴀɪʟ: {stats['users_with_thumbnail']}"
+        f"🖼 ᴜsᴇʀs ᴡɪᴛʜ ᴛʜᴜᴍʙɴᴀɪʟ: {stats['users_with_thumbnail']}\n"
+        f"📶 ʀᴇᴀᴄʜᴀʙʟᴇ: {reach['reachable']} ({reach['reachable_ratio']*100:.1f}%) / "
+        f"📵 ʙʟᴏᴄᴋᴇᴅ ᴏʀ ᴅᴇʟᴇᴛᴇᴅ: {reach['unreachable']}\n\n"
+        f"⚡ ᴜsᴇʀ ᴄᴀᴄʜᴇ: {cache_stats['hits']} ʜɪᴛs / {cache_stats['misses']} ᴍɪssᴇs "
+        f"({cache_stats['hit_ratio']*100:.1f}%)\n"
+        f"📡 ᴍᴇᴍʙᴇʀsʜɪᴘ ᴄʜᴇᴄᴋs: {member_stats['checks_saved']} sᴀᴠᴇᴅ / {member_stats['api_checks']} ᴀᴘɪ ᴄᴀʟʟs / "
+        f"{member_stats['events']} ᴊᴏɪɴ/ʟᴇᴀᴠᴇ ᴇᴠᴇɴᴛs\n"
+        f"🔀 ᴄᴏᴀʟᴇsᴄᴇᴅ ʟᴏᴏᴋᴜᴘs: {flight_stats['shared']} sʜᴀʀᴇᴅ / {flight_stats['calls']} ᴜᴘsᴛʀᴇᴀᴍ\n"
+        f"🎬 ᴠɪᴅᴇᴏ ǫᴜᴇᴜᴇ: {queue_stats['running']} ʀᴜɴɴɪɴɢ / {queue_stats['queued']} ᴡᴀɪᴛɪɴɢ "
+        f"({queue_stats['users_waiting']} ᴜsᴇʀs), ᴡᴀɪᴛ ᴘ50 {queue_stats['wait_p50']:.1f}s / ᴘ95 {queue_stats['wait_p95']:.1f}s\n"
+        f"🗂 ᴍᴇᴅɪᴀ ɢʀᴏᴜᴘs: {batch_stats['items']} ᴠɪᴅᴇᴏs ɪɴ {batch_stats['batches']} ʙᴀᴛᴄʜᴇs\n"
+        f"♻️ ʀᴇsᴜʟᴛ ᴄᴀᴄʜᴇ: {result_stats['hits']} ʜɪᴛs / {result_stats['misses']} ᴍɪssᴇs "
+        f"({result_stats['hit_ratio']*100:.1f}%)\n"
+        f"🧾 ʟᴏɢ ᴄʜᴀɴɴᴇʟ: {log_stats['sent']} sᴇɴᴛ ({log_stats['merged']} ᴍᴇʀɢᴇᴅ) / "
+        f"{log_stats['queued'] + log_stats['media_queued']} ǫᴜᴇᴜᴇᴅ / {log_stats['dropped']} ᴅʀᴏᴘᴘᴇᴅ"
     )
+    for mode, latency in delivery_stats.items():
+        text += (
+            f"\n📨 {mode}: {latency['count']} ᴠɪᴅᴇᴏs, "
+            f"ᴘ50 {latency['p50']*1000:.0f}ᴍs / ᴘ95 {latency['p95']*1000:.0f}ᴍs"
+        )
     await update.message.reply_text(text, parse_mode="HTML")
 
 
+async def indexes_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show users collection index usage"""
+    if not await check_admin(update):
+        return
+    
+    index_stats = await get_index_stats()
+    if not index_stats:
+        return await update.message.reply_text("⚠️ ɴᴏ ɪɴᴅᴇx sᴛᴀᴛs ᴀᴠᴀɪʟᴀʙʟᴇ")
+    
+    lines = ["🗂 ɪɴᴅᴇx ᴜsᴀɢᴇ\n"]
+    for entry in index_stats:
+        if entry["ops"] is None:
+            # Backend does not track index usage
+            lines.append(f"• <code>{entry['name']}</code>")
+            continue
+        since = entry["since"].strftime("%Y-%m-%d %H:%M") if entry["since"] else "-"
+        lines.append(f"• <code>{entry['name']}</code>: {entry['ops']} ᴏᴘs (sɪɴᴄᴇ {since})")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+
 async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show bot status (uptime, CPU, RAM)"""
     if not await check_admin(update):
@@ -1485,7 +1757,8 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"⏰ ᴜᴘᴛɪᴍᴇ: {uptime_hours}ʜ {uptime_mins}ᴍ\\n\\n"
             f"🖥 sʏsᴛᴇᴍ ʀᴇsᴏᴜʀᴄᴇs:\\n"
             f"🔴 ᴄᴘᴜ: {cpu_percent}%\\n"
-            f"🟡 ʀᴀᴍ: {ram_percent}% ({ram.used // (1024**2)} ᴍʙ / {ram.total // (1024**2)} ᴍʙ)"
+            f"🟡 ʀᴀᴍ: {ram_percent}% ({ram.used // (1024**2)} ᴍʙ / {ram.total // (1024**2)} ᴍʙ)\n\n"
+            f"{format_db_health()}"
         )
         await update.message.reply_text(text, parse_mode="HTML")
     except ImportError:
@@ -1501,7 +1774,7 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Broadcast message to all users - usage: /broadcast <message>"""
+    """Broadcast message to users - usage: /broadcast [-cover|-active] <message>"""
     if not await check_admin(update):
         return
     
@@ -1512,88 +1785,139 @@ async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📌 ᴇxᴀᴍᴘʟᴇ: /ʙʀᴏᴀᴅᴄᴀsᴛ ʜᴇʟʟᴏ ᴇᴠᴇʀʏᴏɴᴇ!\\n\\n"
             "💡 ᴛɪᴘs:\\n"
             "• ᴍᴇssᴀɢᴇ sᴇɴᴛ ᴛᴏ ᴀʟʟ ᴜsᴇʀs\\n"
+            "• -cover: ᴏɴʟʏ ᴜsᴇʀs ᴡɪᴛʜ ᴀ ᴄᴏᴠᴇʀ\\n"
+            "• -active: ᴏɴʟʏ ᴜsᴇʀs ᴀᴄᴛɪᴠᴇ ɪɴ ᴛʜᴇ ʟᴀsᴛ 30 ᴅᴀʏs\\n"
             "• ʜᴛᴍʟ ꜰᴏʀᴍᴀᴛᴛɪɴɢ sᴜᴘᴘᴏʀᴛᴇᴅ\\n"
             "• ᴇᴍᴏᴊɪs ᴡᴏʀᴋ ɢʀᴇᴀᴛ ᴛᴏᴏ",
             parse_mode="HTML"
         )
     
     message_text = args[1]
+    audience = "all"
+    flag, _, rest = message_text.partition(" ")
+    if flag in ("-cover", "-active") and rest.strip():
+        audience, message_text = flag[1:], rest.strip()
+    total = await count_audience(audience)
     
     # Show confirmation
     confirm_text = (
         "📢 ʙʀᴏᴀᴅᴄᴀsᴛ ᴄᴏɴꜰɪʀᴍᴀᴛɪᴏɴ\n\n"
         f"📝 ᴍᴇssᴀɢᴇ:\\n"
         f"{message_text}\n\n"
-        f"👥 ᴛᴏᴛᴀʟ ᴜsᴇʀs: {get_total_users()}\n\n"
+        f"👥 ᴛᴏᴛᴀʟ ᴜsᴇʀs: {total} ({audience})\n\n"
         "⚠️ ᴘʀᴏᴄᴇssɪɴɢ... sᴇɴᴅɪɴɢ ɴᴏᴡ"
     )
     msg = await update.message.reply_text(confirm_text, parse_mode="HTML")
-    
+
     try:
-        # Get all user IDs from database
-        from database import db
-        users_collection = db.get_collection("users")
-        all_users = users_collection.find({}, {"user_id": 1})
-        
-        user_ids = [user["user_id"] for user in all_users if "user_id" in user]
-        
-        if not user_ids:
-            await msg.edit_text(
+        job = await create_job(
+            message_text, update.message.from_user.id, msg.chat_id, msg.message_id, total, audience
+        )
+    except Exception as e:
+        logger.error(f"Broadcast error: {e}", exc_info=True)
+        return await msg.edit_text("❌ ʙʀᴏᴀᴅᴄᴀsᴛ ꜰᴀɪʟᴇᴅ\n\nᴅᴀᴛᴀʙᴀsᴇ ᴜɴᴀᴠᴀɪʟᴀʙʟᴇ", parse_mode="HTML")
+    await msg.edit_reply_markup(broadcast_controls(job["job_id"]))
+
+    # Runs in the background so other updates keep being handled during a long broadcast;
+    # progress is checkpointed, so a restart resumes the job instead of starting over
+    spawn_job(run_broadcast(context, job))
+
+
+def broadcast_controls(job_id: str, paused: bool = False) -> InlineKeyboardMarkup:
+    toggle = (InlineKeyboardButton("▶️ Resume", callback_data=f"bc_resume:{job_id}") if paused
+              else InlineKeyboardButton("⏸ Pause", callback_data=f"bc_pause:{job_id}"))
+    return InlineKeyboardMarkup([
+        [toggle, InlineKeyboardButton("✖️ Cancel", callback_data=f"bc_cancel:{job_id}")]
+    ])
+
+
+async def run_broadcast(context: ContextTypes.DEFAULT_TYPE, doc: dict) -> None:
+    """Deliver (or resume) a persisted broadcast job and report the result"""
+    message_text = doc["text"]
+    text = f"📢 <b>Announcement from Admin</b>\n\n{message_text}"
+
+    async def send(user_id: int) -> None:
+        await context.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+
+    async def edit_status(status_text: str) -> None:
+        await context.bot.edit_message_text(
+            status_text, chat_id=doc["chat_id"], message_id=doc["message_id"], parse_mode="HTML"
+        )
+
+    async def show_progress(job: BroadcastJob) -> None:
+        paused = job.state == "paused"
+        remaining = "?" if job.remaining is None else job.remaining
+        eta = "-" if job.eta is None or paused else f"{int(job.eta // 60)}ᴍ {int(job.eta % 60)}s"
+        await context.bot.edit_message_text(
+            f"{'⏸ ʙʀᴏᴀᴅᴄᴀsᴛ ᴘᴀᴜsᴇᴅ' if paused else '📢 ʙʀᴏᴀᴅᴄᴀsᴛɪɴɢ...'}\n\n"
+            f"📤 sᴇɴᴛ: {job.sent}\n"
+            f"❌ ꜰᴀɪʟᴇᴅ: {job.failed}\n"
+            f"⏳ ʀᴇᴍᴀɪɴɪɴɢ: {remaining}\n\n"
+            f"⚡ sᴘᴇᴇᴅ: {job.rate:.1f} ᴍsɢ/s\n"
+            f"🕒 ᴇᴛᴀ: {eta}",
+            chat_id=doc["chat_id"], message_id=doc["message_id"], parse_mode="HTML",
+            reply_markup=broadcast_controls(job.job_id, paused)
+        )
+
+    try:
+        job = BroadcastJob(doc, send)
+        progress = asyncio.create_task(report_progress(job, show_progress))
+        try:
+            await job.run()
+        finally:
+            progress.cancel()
+
+        if job.sent + job.failed == 0:
+            await edit_status(
                 "❌ ɴᴏ ᴜsᴇʀs ꜰᴏᴜɴᴅ\n\n"
-                "💭 ᴅᴀᴛᴀʙᴀsᴇ ɪs ᴇᴍᴘᴛʏ",
-                parse_mode="HTML"
+                "💭 ᴅᴀᴛᴀʙᴀsᴇ ɪs ᴇᴍᴘᴛʏ"
             )
             return
-        
-        # Send message to all users
-        sent = 0
-        failed = 0
-        
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 <b>Announcement from Admin</b>\n\n{message_text}",
-                    parse_mode="HTML"
-                )
-                sent += 1
-            except Exception as e:
-                logger.warning(f"Could not send broadcast to user {user_id}: {e}")
-                failed += 1
+        sent, failed = job.sent, job.failed
         
         # Show final status
         result_text = (
-            "✅ ʙʀᴏᴀᴅᴄᴀsᴛ ᴄᴏᴍᴘʟᴇᴛᴇᴅ\n\n"
+            f"{'✖️ ʙʀᴏᴀᴅᴄᴀsᴛ ᴄᴀɴᴄᴇʟʟᴇᴅ' if job.state == 'cancelled' else '✅ ʙʀᴏᴀᴅᴄᴀsᴛ ᴄᴏᴍᴘʟᴇᴛᴇᴅ'}\n\n"
             f"📤 sᴇɴᴛ: {sent}\n"
-            f"❌ ꜰᴀɪʟᴇᴅ: {failed}\n"
+            f"❌ ꜰᴀɪʟᴇᴅ: {failed} (📵 {job.unreachable} ʙʟᴏᴄᴋᴇᴅ/ᴅᴇʟᴇᴛᴇᴅ, sᴋɪᴘᴘᴇᴅ ɴᴇxᴛ ᴛɪᴍᴇ)\n"
             f"👥 ᴛᴏᴛᴀʟ: {sent + failed}\n\n"
-            f"📊 sᴜᴄᴄᴇss: {(sent/(sent+failed)*100):.1f}%"
+            f"📊 sᴜᴄᴄᴇss: {(sent/(sent+failed)*100):.1f}%\n"
+            f"⚡ sᴘᴇᴇᴅ: {job.broadcast.rate:.1f} ᴍsɢ/s ɪɴ {job.broadcast.elapsed:.0f}s"
         )
         
-        await msg.edit_text(result_text, parse_mode="HTML")
+        await edit_status(result_text)
         
         # Log broadcast
         if LOG_CHANNEL_ID:
             log_text = (
                 f"📢 <b>Broadcast Sent</b>\n\n"
-                f"👤 Admin: @{update.message.from_user.username or update.message.from_user.id}\n"
+                f"👤 Admin: <code>{doc.get('admin_id')}</code>\n"
                 f"📤 Messages Sent: {sent}\n"
                 f"❌ Failed: {failed}\n"
+                f"⚡ Speed: {job.broadcast.rate:.1f} msg/s\n"
                 f"📝 Message:\n{message_text}"
             )
-            await send_log(context, log_text)
+            send_log(context, log_text, important=True)
         
     except Exception as e:
-        await msg.edit_text(
-            f"❌ ʙʀᴏᴀᴅᴄᴀsᴛ ꜰᴀɪʟᴇᴅ\\n\\n"
-            f"ᴇʀʀᴏʀ: {str(e)[:100]}\\n\\n"
-            "ᴄʜᴇᴄᴋ ʟᴏɢs ꜰᴏʀ ᴅᴇᴛᴀɪʟs.",
-            parse_mode="HTML"
-        )
         logger.error(f"Broadcast error: {e}", exc_info=True)
+        try:
+            await edit_status(
+                f"❌ ʙʀᴏᴀᴅᴄᴀsᴛ ꜰᴀɪʟᴇᴅ\\n\\n"
+                f"ᴇʀʀᴏʀ: {str(e)[:100]}\\n\\n"
+                "ᴄʜᴇᴄᴋ ʟᴏɢs ꜰᴏʀ ᴅᴇᴛᴀɪʟs."
+            )
+        except Exception:
+            pass
 
 
 
+async def track_returning_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """A user who messages the bot can receive broadcasts again"""
+    if update.effective_user:
+        await mark_reachable(update.effective_user.id)
+
+
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages"""
     if not await check_force_sub(update, context):
@@ -1631,6 +1955,7 @@ def main() -> None:
             BotCommand("unban", "✅ Unban user"),
             BotCommand("stats", "📊 Bot statistics"),
             BotCommand("status", "⏱️ Bot status"),
+            BotCommand("indexes", "🗂 Index usage"),
             BotCommand("broadcast", "📢 Broadcast message"),
         ]
         
@@ -1640,8 +1965,42 @@ def main() -> None:
         except Exception as e:
             logger.error(f"❌ Error setting bot commands: {e}")
     
-    # Register post_init callback to setup commands
-    app.post_init = setup_commands
+    async def on_startup(app: Application) -> None:
+        """Connect the database and invalidation bus, detect channel events, then setup bot commands"""
+        await init_db()
+        await bus.start()
+        if FORCE_SUB_CHANNEL:
+            await enable_event_feed(app.bot, FORCE_SUB_CHANNEL)
+            await start_invite_pool(app.bot, FORCE_SUB_CHANNEL)
+        video_scheduler.start()
+        log_pipeline.start(app.bot)
+        await setup_commands(app)
+
+        # Pick up broadcasts interrupted by a restart or left behind by a dead worker
+        context = app.context_types.context(app)
+        app.bot_data["broadcast_resumer"] = asyncio.create_task(
+            resume_jobs_loop(lambda doc: spawn_job(run_broadcast(context, doc)))
+        )
+
+    async def on_shutdown(app: Application) -> None:
+        """Checkpoint running broadcasts and release the database connection, then publish any last invalidations"""
+        stop_invite_pool()
+        await video_batcher.stop()
+        await video_scheduler.stop()
+        resumer = app.bot_data.pop("broadcast_resumer", None)
+        if resumer is not None:
+            resumer.cancel()
+        await stop_jobs()
+        await log_pipeline.stop()
+        await close_db()
+        await bus.stop()
+
+    # Register lifecycle callbacks
+    app.post_init = on_startup
+    app.post_shutdown = on_shutdown
+
+    # Runs before every other handler (group -1) without stopping them
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, track_returning_user), group=-1)
 
     # Command handlers (MUST be registered FIRST before text handler)
     app.add_handler(CommandHandler("start", start, filters=filters.ChatType.PRIVATE))
@@ -1657,6 +2016,7 @@ def main() -> None:
     app.add_handler(CommandHandler("unban", unban_cmd, filters=filters.ChatType.PRIVATE))
     app.add_handler(CommandHandler("stats", stats_cmd, filters=filters.ChatType.PRIVATE))
     app.add_handler(CommandHandler("status", status_cmd, filters=filters.ChatType.PRIVATE))
+    app.add_handler(CommandHandler("indexes", indexes_cmd, filters=filters.ChatType.PRIVATE))
     app.add_handler(CommandHandler("broadcast", broadcast_cmd, filters=filters.ChatType.PRIVATE))
 
     # Photo and video handlers (private chats only via filters)
@@ -1670,12 +2030,16 @@ def main() -> None:
     # Register callback handler (handles all callbacks)
     app.add_handler(CallbackQueryHandler(callback_handler))
 
+    # Force-sub channel joins/leaves (delivered only while the bot is a channel admin)
+    app.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.CHAT_MEMBER))
+
     logger.info("✅ All handlers registered")
     logger.info("Bot starting (polling)")
     app.run_polling(
         allowed_updates=[
             "message",
             "callback_query",
+            "chat_member",
         ],
         close_loop=False,
     )
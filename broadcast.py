@@ -0,0 +1,437 @@
+"""
+Broadcast Engine for Video Cover Bot
+Delivers one message to many users with bounded concurrency under Telegram's global
+send limit, pausing every sender when Telegram answers with RetryAfter. Broadcasts run
+as persisted jobs that checkpoint their progress and resume after a restart.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from database import (
+    iter_user_ids, save_broadcast_job, claim_broadcast_job, list_broadcast_jobs,
+    record_broadcast_deliveries, get_delivered_ids, clear_broadcast_deliveries, mark_unreachable
+)
+from invalidation import bus
+from ratelimit import TokenBucket, retry_after_seconds
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second across all chats; stay a little below it
+# so replies to regular users still get through while a broadcast runs
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_BURST = int(os.environ.get("BROADCAST_BURST", "25"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+
+# Attempts per recipient when Telegram asks us to slow down
+BROADCAST_MAX_RETRIES = 3
+
+# Delivery results are written in bulk every BROADCAST_CHECKPOINT_BATCH results or
+# BROADCAST_CHECKPOINT_INTERVAL seconds; that write doubles as the job owner's heartbeat
+BROADCAST_CHECKPOINT_BATCH = int(os.environ.get("BROADCAST_CHECKPOINT_BATCH", "500"))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.environ.get("BROADCAST_CHECKPOINT_INTERVAL", "5"))
+
+# A job whose owner has not written a checkpoint for this long is taken over by another
+# worker (or by this one after a restart)
+BROADCAST_JOB_LEASE = float(os.environ.get("BROADCAST_JOB_LEASE", "30"))
+
+# Seconds between edits of a running broadcast's status message; an edit is skipped when
+# no recipient was handled since the last one
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Jobs in these states are resumed; "completed" and "cancelled" are final
+JOB_ACTIVE_STATES = ("running", "paused")
+
+
+# One bucket for the whole process: concurrent broadcasts share Telegram's global limit
+limiter = TokenBucket(BROADCAST_RATE, BROADCAST_BURST)
+
+
+def unreachable_reason(error: Exception) -> str | None:
+    """Why a user can never receive messages again, or None for a transient failure"""
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        # "bot was blocked by the user", "user is deactivated", ...
+        return "deactivated" if "deactivated" in message else "blocked"
+    if isinstance(error, BadRequest) and "chat not found" in message:
+        return "chat_not_found"
+    return None
+
+
+class Broadcast:
+    """
+    One delivery run. `send(user_id)` is a coroutine that delivers to one user; recipients
+    is an async iterator of user ids consumed as workers free up, so it may be a database
+    cursor. `on_result(user_id, outcome, error)` is awaited after every recipient with
+    outcome "sent", "failed", or "unreachable" (blocked the bot or account gone; also
+    counted in failed).
+    """
+
+    def __init__(self, send, recipients, total: int = None, concurrency: int = BROADCAST_CONCURRENCY,
+                 bucket: TokenBucket = None, on_result=None):
+        self.send = send
+        self.recipients = recipients
+        self.total = total
+        self.concurrency = max(1, concurrency)
+        self.bucket = bucket or limiter
+        self.on_result = on_result
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.flood_waits = 0
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self._running = asyncio.Event()
+        self._running.set()
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Achieved deliveries (sent or failed) per second"""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self._running.set()
+
+    async def run(self) -> "Broadcast":
+        """Deliver to every recipient; returns self with final counters"""
+        self.started_at = time.monotonic()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            async for user_id in self.recipients:
+                if self.cancelled:
+                    break
+                await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished_at = time.monotonic()
+
+        logger.info(
+            f"📢 Broadcast {'cancelled' if self.cancelled else 'finished'}: {self.sent} sent, "
+            f"{self.failed} failed in {self.elapsed:.1f}s ({self.rate:.1f} msg/s)"
+        )
+        return self
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            if self.cancelled:
+                continue
+            await self._deliver(user_id)
+
+    async def _deliver(self, user_id: int) -> None:
+        error = None
+        for _ in range(BROADCAST_MAX_RETRIES):
+            await self._running.wait()
+            if self.cancelled:
+                return
+            await self.bucket.acquire()
+            try:
+                await self.send(user_id)
+                error = None
+                break
+            except RetryAfter as e:
+                # Flood control applies to the whole bot: stop every worker, then retry
+                secs = retry_after_seconds(e)
+                self.flood_waits += 1
+                self.bucket.pause(secs)
+                logger.warning(f"⏳ Broadcast flood-limited, pausing {secs:g}s")
+                error = e
+            except Exception as e:
+                error = e
+                break
+
+        outcome = "sent"
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            if unreachable_reason(error):
+                outcome = "unreachable"
+                self.unreachable += 1
+                logger.debug(f"User {user_id} is unreachable: {error}")
+            else:
+                outcome = "failed"
+                logger.warning(f"Could not send broadcast to user {user_id}: {error}")
+        if self.on_result is not None:
+            await self.on_result(user_id, outcome, error)
+
+
+"""═══════════════════ PERSISTED JOBS ═══════════════════"""
+
+
+# job_id -> BroadcastJob running in this process
+active_jobs = {}
+
+# Tasks started by spawn_job(), cancelled (and checkpointed) by stop_jobs()
+_job_tasks = set()
+
+
+class BroadcastJob:
+    """
+    A Broadcast backed by a job document. Results are buffered and written in bulk with a
+    checkpoint: every user_id at or below it has been handled, and handled ids above it
+    are read back from the delivery records on resume, so nobody gets the message twice.
+    """
+
+    def __init__(self, doc: dict, send):
+        self.doc = doc
+        self.job_id = doc["job_id"]
+        self.send = send
+        self.checkpoint = doc.get("checkpoint")
+        self.prior_sent = doc.get("sent", 0)
+        self.prior_failed = doc.get("failed", 0)
+        self.prior_unreachable = doc.get("unreachable", 0)
+        self.broadcast = None
+        self._buffer = []
+        self._unreachable = []
+        self._pending = set()
+        self._last_dispatched = self.checkpoint
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def state(self) -> str:
+        return self.doc.get("state", "running")
+
+    @property
+    def sent(self) -> int:
+        return self.prior_sent + (self.broadcast.sent if self.broadcast else 0)
+
+    @property
+    def failed(self) -> int:
+        return self.prior_failed + (self.broadcast.failed if self.broadcast else 0)
+
+    @property
+    def unreachable(self) -> int:
+        return self.prior_unreachable + (self.broadcast.unreachable if self.broadcast else 0)
+
+    @property
+    def remaining(self) -> int | None:
+        total = self.doc.get("total")
+        return max(total - self.sent - self.failed, 0) if total is not None else None
+
+    @property
+    def rate(self) -> float:
+        return self.broadcast.rate if self.broadcast else 0.0
+
+    @property
+    def eta(self) -> float | None:
+        """Seconds left at the current rate, or None while unknown"""
+        if self.remaining is None or self.rate <= 0:
+            return None
+        return self.remaining / self.rate
+
+    async def _recipients(self):
+        handled = await get_delivered_ids(self.job_id, self.checkpoint)
+        async for user_id in iter_user_ids(after_id=self.checkpoint, audience=self.doc.get("audience", "all")):
+            if user_id in handled:
+                continue
+            self._pending.add(user_id)
+            self._last_dispatched = user_id
+            yield user_id
+
+    async def _on_result(self, user_id: int, outcome: str, error) -> None:
+        self._pending.discard(user_id)
+        self._buffer.append((user_id, outcome))
+        if outcome == "unreachable":
+            self._unreachable.append((user_id, unreachable_reason(error)))
+        if len(self._buffer) >= BROADCAST_CHECKPOINT_BATCH:
+            await self.flush()
+
+    def _safe_checkpoint(self):
+        # Recipients are dispatched in ascending order, so everything below the lowest
+        # id still in flight is done
+        if self._pending:
+            return min(self._pending) - 1
+        return self._last_dispatched
+
+    async def flush(self, final_state: str = None) -> None:
+        """Write buffered results, then advance the checkpoint and counters"""
+        async with self._flush_lock:
+            # Best effort: a user missed here is detected again by the next broadcast
+            dead, self._unreachable = self._unreachable, []
+            await mark_unreachable(dead)
+
+            batch, self._buffer = self._buffer, []
+            try:
+                stored = not batch or await record_broadcast_deliveries(self.job_id, batch)
+            except asyncio.CancelledError:
+                # Shutdown hit mid-write: the final flush writes these again (an upsert)
+                self._buffer = batch + self._buffer
+                raise
+            if not stored:
+                # Keep the checkpoint where it is until these results are stored
+                self._buffer = batch + self._buffer
+                return
+
+            checkpoint = self._safe_checkpoint()
+            fields = {"sent": self.sent, "failed": self.failed, "unreachable": self.unreachable, "checkpoint": checkpoint}
+            if final_state is not None:
+                fields.update({"state": final_state, "finished_at": datetime.now(), "owner": None})
+                self.doc["state"] = final_state
+            if await save_broadcast_job(self.job_id, fields):
+                self.checkpoint = checkpoint
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+            await self.flush()
+
+    async def run(self) -> "BroadcastJob":
+        """Run (or resume) the job until it completes, is cancelled, or this task is cancelled"""
+        self.broadcast = Broadcast(
+            self.send, self._recipients(), total=self.doc.get("total"), on_result=self._on_result
+        )
+        if self.state == "paused":
+            self.broadcast.pause()
+        active_jobs[self.job_id] = self
+        ticker = asyncio.create_task(self._flush_loop())
+
+        finished = False
+        try:
+            await self.broadcast.run()
+            finished = True
+        finally:
+            ticker.cancel()
+            active_jobs.pop(self.job_id, None)
+            if finished:
+                await self.flush("cancelled" if self.broadcast.cancelled else "completed")
+                await clear_broadcast_deliveries(self.job_id)
+            else:
+                # Shutting down: checkpoint and release the job so it resumes right away
+                await self.flush()
+                await save_broadcast_job(self.job_id, {"owner": None})
+        return self
+
+
+async def report_progress(job: BroadcastJob, edit, interval: float = BROADCAST_PROGRESS_INTERVAL) -> None:
+    """
+    Call edit(job) every `interval` seconds while the job runs, skipping ticks where the
+    counters and state are unchanged. Run as a task and cancel it when the job ends.
+    """
+    last = None
+    while True:
+        await asyncio.sleep(interval)
+        snapshot = (job.sent, job.failed, job.state)
+        if snapshot == last:
+            continue
+        try:
+            await edit(job)
+            last = snapshot
+        except RetryAfter as e:
+            # Status edits share the bot's limit with the broadcast itself; fall behind instead
+            await asyncio.sleep(retry_after_seconds(e))
+        except Exception as e:
+            logger.debug(f"Could not update broadcast {job.job_id} progress: {e}")
+
+
+async def create_job(text: str, admin_id: int, chat_id: int, message_id: int, total: int,
+                     audience: str = "all") -> dict:
+    """Persist a new broadcast job owned by this process"""
+    doc = {
+        "job_id": uuid.uuid4().hex[:10],
+        "state": "running",
+        "text": text,
+        "audience": audience,
+        "admin_id": admin_id,
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "total": total,
+        "sent": 0,
+        "failed": 0,
+        "unreachable": 0,
+        "checkpoint": None,
+        "owner": bus.origin,
+        "created_at": datetime.now()
+    }
+    if not await save_broadcast_job(doc["job_id"], doc):
+        raise RuntimeError("could not save broadcast job")
+    return doc
+
+
+async def set_job_state(job_id: str, state: str) -> bool:
+    """Pause, resume or cancel a job running in this process"""
+    job = active_jobs.get(job_id)
+    if job is None or job.state not in JOB_ACTIVE_STATES:
+        return False
+
+    if state == "paused":
+        job.broadcast.pause()
+    elif state == "running":
+        job.broadcast.resume()
+    elif state == "cancelled":
+        job.broadcast.cancel()
+    else:
+        raise ValueError(f"Unknown broadcast job state: {state!r}")
+    job.doc["state"] = state
+    await save_broadcast_job(job_id, {"state": state})
+    logger.info(f"📢 Broadcast {job_id} {state}")
+    return True
+
+
+def spawn_job(coro) -> asyncio.Task:
+    """Run a job coroutine in the background, tracked so shutdown can checkpoint it"""
+    task = asyncio.create_task(coro)
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return task
+
+
+async def stop_jobs() -> None:
+    """Cancel running jobs; each one writes a final checkpoint before exiting"""
+    tasks = list(_job_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def resume_jobs_loop(start) -> None:
+    """
+    Claim active jobs that no live worker owns and hand them to start(doc). Runs for the
+    whole process lifetime, so jobs of a crashed worker move here once their lease expires.
+    """
+    while True:
+        for doc in await list_broadcast_jobs(JOB_ACTIVE_STATES):
+            # Skip jobs this process runs or is about to start
+            if doc["job_id"] in active_jobs or doc.get("owner") == bus.origin:
+                continue
+            claimed = await claim_broadcast_job(doc["job_id"], bus.origin, BROADCAST_JOB_LEASE)
+            if claimed is not None and claimed.get("state") in JOB_ACTIVE_STATES:
+                logger.info(f"📢 Resuming broadcast {claimed['job_id']} after user {claimed.get('checkpoint')}")
+                start(claimed)
+        await asyncio.sleep(BROADCAST_JOB_LEASE)
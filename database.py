@@ -1,50 +1,495 @@
 """
-MongoDB Database Module for Video Cover Bot
-Handles all database operations for user thumbnails
+Database Module for Video Cover Bot (async)
+Handles all database operations for user thumbnails on top of a pluggable
+storage backend (MongoDB or embedded SQLite, see storage.py)
 """
 
 import os
+import time
+import asyncio
 import logging
-from datetime import datetime
-from pymongo import MongoClient
+from datetime import datetime, timedelta
+from cache import TTLCache, single_flight
+from invalidation import bus
+from storage import create_storage, STATS_KEYS, ChangeFeedUnsupported
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# MongoDB Connection Setup
-MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
-MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "video_cover_bot")
-
-try:
-    mongo_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-    db = mongo_client[MONGODB_DATABASE]
-    users_collection = db["users"]
-    # Test connection
-    mongo_client.server_info()
-    logger.info("✅ MongoDB connected successfully")
+# User record cache: bounded LRU with a TTL so edits made outside this process are picked up
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+
+# Seconds between full recounts that repair drift in the stats counters document
+STATS_RECONCILE_INTERVAL = float(os.environ.get("STATS_RECONCILE_INTERVAL", "3600"))
+
+# "sync" writes each update immediately; "behind" coalesces updates per user and
+# flushes them with one bulk write once WRITE_BATCH_SIZE users are pending or every
+# WRITE_FLUSH_INTERVAL seconds
+WRITE_MODE = os.environ.get("WRITE_MODE", "sync").strip().lower()
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "200"))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", "2"))
+
+# Health monitor: ping interval while healthy, reconnect backoff bounds while down
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "15"))
+HEALTH_PING_TIMEOUT = float(os.environ.get("HEALTH_PING_TIMEOUT", "3"))
+RECONNECT_BACKOFF_MIN = float(os.environ.get("RECONNECT_BACKOFF_MIN", "1"))
+RECONNECT_BACKOFF_MAX = float(os.environ.get("RECONNECT_BACKOFF_MAX", "60"))
+
+# Circuit breaker: this many consecutive failed operations mark the database down
+# so handlers fail fast until the monitor's next successful probe
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))
+
+# Banned ids are held in memory and kept current by the backend's change feed; backends
+# without one (SQLite, standalone MongoDB) reload the set every BAN_SYNC_INTERVAL seconds
+BAN_SYNC_INTERVAL = float(os.environ.get("BAN_SYNC_INTERVAL", "30"))
+
+# Covered outputs already sent, keyed by video, cover and caption; RESULT_CACHE_DB also
+# keeps them in the database so they survive restarts and are shared between workers
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "20000"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_DB = os.environ.get("RESULT_CACHE_DB", "false").strip().lower() in ("1", "true", "yes")
+
+# Broadcast audiences: "all", "cover" (users with a saved cover) and "active" (users who
+# saved a cover or passed verification within the last ACTIVE_USER_DAYS days). Users
+# marked unreachable are left out of every audience.
+AUDIENCES = ("all", "cover", "active")
+ACTIVE_USER_DAYS = int(os.environ.get("ACTIVE_USER_DAYS", "30"))
+
+# The backend is created by init_db() so it binds to the running event loop
+storage = None
+DB_AVAILABLE = False
+
+# Connection state tracked by the health monitor: "connecting", "connected" or "disconnected"
+DB_STATE = "connecting"
+_state_since = time.time()
+_last_error = None
+_consecutive_failures = 0
+_schema_ready = False
+_health_wakeup = asyncio.Event()
+# Transitions to "disconnected"; the health monitor restarts its backoff on each new one
+_outages = 0
+
+# Fields read by the bot; everything else on a user document stays on the server
+PROFILE_FIELDS = (
+    "user_id", "photo_id", "photo_unique_id", "is_banned", "ban_reason",
+    "banned_at", "unbanned_at", "updated_at", "verified_at", "unreachable"
+)
+
+# Set on users a broadcast could not reach; cleared when the user messages the bot again
+UNREACHABLE_FIELDS = ("unreachable", "unreachable_reason", "unreachable_at")
+
+# user_id -> projected user document; an empty dict records that the user has no document yet
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# result key -> {"video": file_id, "cover": file_id} of a covered video already sent
+result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+_result_db_hits = 0
+
+# Every banned user_id; authoritative for ban checks once _bans_loaded is set
+_banned_ids = set()
+_bans_loaded = False
+
+# Long-running tasks started by init_db() and cancelled by close_db()
+_background_tasks = []
+
+# Write-behind state: user_id -> {"set": dict, "unset": set, "upsert": bool}, plus stats deltas
+_pending_writes = {}
+_pending_stats = {}
+_flush_wakeup = asyncio.Event()
+_flush_lock = asyncio.Lock()
+
+
+async def init_db() -> bool:
+    """
+    Connect the configured storage backend. Call once from the bot's post_init.
+    If the database is down at boot, the health monitor keeps retrying in the background.
+    """
+    global storage
+
+    try:
+        storage = create_storage()
+    except Exception as e:
+        logger.error(f"❌ Invalid storage configuration: {e}")
+        return False
+
+    try:
+        await _connect_storage()
+    except Exception as e:
+        _mark_down(e)
+        logger.warning("⚠️ Bot will work with limited functionality until the database comes back")
+
+    _background_tasks.append(asyncio.create_task(_health_monitor()))
+    _background_tasks.append(asyncio.create_task(_reconcile_stats_loop()))
+    _background_tasks.append(asyncio.create_task(_ban_sync_loop()))
+    if WRITE_MODE == "behind":
+        _background_tasks.append(asyncio.create_task(_flush_loop()))
+        logger.info(f"✍️ Write-behind enabled (batch {WRITE_BATCH_SIZE}, every {WRITE_FLUSH_INTERVAL}s)")
+    return DB_AVAILABLE
+
+
+async def close_db() -> None:
+    """Flush pending writes and close the storage backend on shutdown"""
+    global DB_AVAILABLE
+
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    if DB_AVAILABLE and _pending_writes:
+        await flush_writes()
+    DB_AVAILABLE = False
+    if storage is not None:
+        await storage.close()
+        logger.info(f"🔌 {storage.label} connection closed")
+
+
+"""═══════════════════ HEALTH & CIRCUIT BREAKER ═══════════════════"""
+
+
+async def _connect_storage() -> None:
+    """Open the backend and apply migrations the first time it becomes reachable"""
+    global _schema_ready
+
+    await storage.connect()
+    if not _schema_ready:
+        version = await storage.ensure_schema()
+        logger.info(f"🗂 Schema version: {version}")
+        _schema_ready = True
+    if not _bans_loaded:
+        await load_banned_ids()
+    _mark_up()
+
+
+def _set_state(state: str) -> None:
+    global DB_STATE, _state_since
+
+    if state == DB_STATE:
+        return
+    logger.warning(f"🗄 Database state: {DB_STATE} → {state}")
+    DB_STATE = state
+    _state_since = time.time()
+
+
+def _mark_up() -> None:
+    """Database reachable: close the breaker and resume normal operation"""
+    global DB_AVAILABLE, _consecutive_failures
+
+    _consecutive_failures = 0
     DB_AVAILABLE = True
-except Exception as e:
-    logger.warning(f"⚠️ MongoDB not available: {e}")
-    logger.warning("⚠️ Bot will work with limited functionality (thumbnails won't persist)")
+    if DB_STATE != "connected":
+        logger.info(f"✅ {storage.label} connected successfully")
+    _set_state("connected")
+
+
+def _mark_down(error: Exception) -> None:
+    """Database unreachable: open the breaker so calls return defaults immediately"""
+    global DB_AVAILABLE, _last_error, _outages
+
+    _last_error = str(error)
     DB_AVAILABLE = False
-    users_collection = None
+    if DB_STATE != "disconnected":
+        _outages += 1
+        logger.warning(f"⚠️ Database not available: {error}")
+    _set_state("disconnected")
+    _health_wakeup.set()
+
+
+def _record_success() -> None:
+    global _consecutive_failures
+    _consecutive_failures = 0
+
+
+def _record_failure(error: Exception) -> None:
+    """Count a failed operation; trip the breaker after BREAKER_FAILURE_THRESHOLD in a row"""
+    global _consecutive_failures
+
+    _consecutive_failures += 1
+    if DB_AVAILABLE and _consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+        logger.warning(f"⚡ Circuit breaker open after {_consecutive_failures} consecutive failures")
+        _mark_down(error)
+
+
+async def _health_monitor() -> None:
+    """Ping the backend periodically and reconnect with exponential backoff while it is down"""
+    global _last_error
+
+    delay = HEALTH_CHECK_INTERVAL if DB_AVAILABLE else RECONNECT_BACKOFF_MIN
+    seen_outages = _outages
+    while True:
+        try:
+            await asyncio.wait_for(_health_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        _health_wakeup.clear()
+
+        try:
+            if _schema_ready:
+                await asyncio.wait_for(storage.ping(), timeout=HEALTH_PING_TIMEOUT)
+                _mark_up()
+            else:
+                # Never reached the database since boot
+                await _connect_storage()
+            delay = HEALTH_CHECK_INTERVAL
+        except Exception as e:
+            if DB_AVAILABLE:
+                _mark_down(e)
+            else:
+                _last_error = str(e)
+            if _outages != seen_outages:
+                # Just went down, here or through the circuit breaker: start the backoff over
+                seen_outages = _outages
+                delay = RECONNECT_BACKOFF_MIN
+            else:
+                delay = min(max(delay, RECONNECT_BACKOFF_MIN) * 2, RECONNECT_BACKOFF_MAX)
+            # A wake-up raised by _mark_down is answered by the backoff sleep, not immediately
+            _health_wakeup.clear()
+            logger.info(f"🔁 Next database probe in {delay:.1f}s")
+
+
+def get_db_health() -> dict:
+    """Connection state for admin screens"""
+    return {
+        "backend": storage.label if storage else "-",
+        "state": DB_STATE,
+        "since": datetime.fromtimestamp(_state_since),
+        "consecutive_failures": _consecutive_failures,
+        "last_error": _last_error
+    }
+
+
+"""═══════════════════ SCHEMA & INDEXES ═══════════════════"""
+
+
+async def get_index_stats() -> list[dict]:
+    """Get per-index usage counters for the users store"""
+    if not DB_AVAILABLE:
+        return []
+
+    try:
+        stats = await storage.index_stats()
+        return sorted(stats, key=lambda item: item["name"])
+    except Exception as e:
+        logger.error(f"❌ Error getting index stats: {e}")
+        return []
+
+
+"""═══════════════════ USER CACHE ═══════════════════"""
+
+
+async def _get_user_record(user_id: int) -> dict:
+    """Read-through lookup of a user document; returns {} when the user has none"""
+    record = user_cache.get(user_id)
+    if record is not None:
+        return record
+
+    # Concurrent misses for one user (album bursts) share a single read
+    return await single_flight.do(("profile", user_id), lambda: _load_user_record(user_id))
 
 
-def save_thumbnail(user_id: int, photo_id: str) -> bool:
-    """Save or update user's thumbnail to MongoDB"""
+async def _load_user_record(user_id: int) -> dict:
+    record = await storage.get_user(user_id, PROFILE_FIELDS) or {}
+    _record_success()
+    pending = _pending_writes.get(user_id)
+    if pending:
+        # Read-your-writes: layer queued updates over what the server has
+        record = _apply_fields(record, pending["set"], pending["unset"], pending["upsert"])
+    user_cache.set(user_id, record)
+    return record
+
+
+def _apply_fields(record: dict, set_fields: dict, unset_fields, upsert: bool) -> dict:
+    """Return a copy of a user record with an update applied"""
+    if not record and not upsert:
+        return {}
+    after = dict(record)
+    after.update(set_fields or {})
+    for field in unset_fields:
+        after.pop(field, None)
+    return after
+
+
+async def _update_user(user_id: int, set_fields: dict = None, unset_fields: tuple = (), upsert: bool = False) -> dict | None:
+    """
+    Apply an update to one user document and return its state from before the update.
+    Writes the new state through the user cache and adjusts the stats counters.
+    """
+    if WRITE_MODE == "behind":
+        return await _queue_user_update(user_id, set_fields, unset_fields, upsert)
+
+    before = await storage.update_user(user_id, set_fields, unset_fields, upsert, PROFILE_FIELDS)
+    _record_success()
+
+    after = _apply_fields(before or {}, set_fields, unset_fields, upsert)
+    user_cache.set(user_id, after)
+    _publish_user_change(user_id, set_fields)
+    await _apply_stats_delta(before, after)
+    return before
+
+
+def _publish_user_change(user_id: int, set_fields: dict) -> None:
+    """Tell other workers to drop their copy of a user written by this one"""
+    data = {}
+    if set_fields and "is_banned" in set_fields:
+        data["is_banned"] = bool(set_fields["is_banned"])
+    bus.publish("user", user_id, data)
+
+
+def _on_user_invalidated(user_id: int, data: dict) -> None:
+    """Another worker wrote this user: re-read it on next use"""
+    user_cache.pop(user_id)
+    if "is_banned" in data:
+        _apply_ban_change(user_id, data["is_banned"])
+
+
+bus.subscribe("user", _on_user_invalidated)
+
+
+"""═══════════════════ WRITE-BEHIND ═══════════════════"""
+
+
+async def _queue_user_update(user_id: int, set_fields: dict, unset_fields: tuple, upsert: bool) -> dict | None:
+    """Record an update in process memory and leave the database write to the flusher"""
+    record = await _get_user_record(user_id)
+    before = record or None
+    if before is None and not upsert:
+        return None
+
+    pending = _pending_writes.setdefault(user_id, {"set": {}, "unset": set(), "upsert": False})
+    for field, value in (set_fields or {}).items():
+        pending["set"][field] = value
+        pending["unset"].discard(field)
+    for field in unset_fields:
+        pending["set"].pop(field, None)
+        pending["unset"].add(field)
+    pending["upsert"] = pending["upsert"] or upsert
+
+    after = _apply_fields(record, set_fields, unset_fields, upsert)
+    user_cache.set(user_id, after)
+    await _apply_stats_delta(before, after)
+
+    if len(_pending_writes) >= WRITE_BATCH_SIZE:
+        _flush_wakeup.set()
+    return before
+
+
+async def flush_writes() -> int:
+    """Write every queued user update in one bulk write; returns the number of users flushed"""
+    global _pending_writes, _pending_stats
+
+    async with _flush_lock:
+        if not _pending_writes and not _pending_stats:
+            return 0
+
+        batch, stats = _pending_writes, _pending_stats
+        _pending_writes, _pending_stats = {}, {}
+
+        updates = [
+            (user_id, pending["set"], tuple(pending["unset"]), pending["upsert"])
+            for user_id, pending in batch.items()
+        ]
+
+        try:
+            await storage.bulk_update_users(updates)
+            if stats:
+                await storage.inc_counters("user_stats", stats)
+        except Exception as e:
+            logger.error(f"❌ Error flushing {len(batch)} queued writes, will retry: {e}")
+            _requeue(batch, stats)
+            _record_failure(e)
+            return 0
+
+        # Other workers only see these writes once they are in the store
+        for user_id, pending in batch.items():
+            _publish_user_change(user_id, pending["set"])
+        logger.debug(f"✍️ Flushed queued writes for {len(batch)} users")
+        return len(batch)
+
+
+def _requeue(batch: dict, stats: dict) -> None:
+    """Put a failed batch back underneath any updates queued since it was taken"""
+    for user_id, older in batch.items():
+        newer = _pending_writes.get(user_id)
+        if newer is None:
+            _pending_writes[user_id] = older
+            continue
+        merged_set = {k: v for k, v in older["set"].items() if k not in newer["unset"]}
+        merged_set.update(newer["set"])
+        merged_unset = (older["unset"] - set(newer["set"])) | newer["unset"]
+        _pending_writes[user_id] = {
+            "set": merged_set,
+            "unset": merged_unset,
+            "upsert": older["upsert"] or newer["upsert"]
+        }
+    for key, value in stats.items():
+        _pending_stats[key] = _pending_stats.get(key, 0) + value
+
+
+async def _flush_loop() -> None:
+    """Flush queued writes every WRITE_FLUSH_INTERVAL seconds, or sooner once a batch fills"""
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), timeout=WRITE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        if DB_AVAILABLE:
+            await flush_writes()
+
+
+def get_cache_stats() -> dict:
+    """Get user cache hit/miss counters"""
+    return user_cache.stats()
+
+
+def _build_profile(user_id: int, record: dict, loaded: bool = True) -> dict:
+    """
+    Shape a projected user document into the profile dict handlers consume; loaded=False
+    marks the defaults returned when the database could not be read
+    """
+    return {
+        "user_id": user_id,
+        "loaded": loaded,
+        "exists": bool(record),
+        "is_banned": _is_banned(user_id, record),
+        "ban_reason": record.get("ban_reason"),
+        "photo_id": record.get("photo_id"),
+        "photo_unique_id": record.get("photo_unique_id"),
+        "updated_at": record.get("updated_at"),
+        "banned_at": record.get("banned_at"),
+        "unbanned_at": record.get("unbanned_at"),
+        "verified_at": record.get("verified_at"),
+        "unreachable": record.get("unreachable", False)
+    }
+
+
+async def get_user_profile(user_id: int) -> dict:
+    """Get ban status, ban reason, cover id, verification and timestamps for a user in one read"""
+    if not DB_AVAILABLE:
+        logger.debug(f"Database not available, returning empty profile for user {user_id}")
+        return _build_profile(user_id, {}, loaded=False)
+
+    try:
+        return _build_profile(user_id, await _get_user_record(user_id))
+    except Exception as e:
+        logger.error(f"❌ Error retrieving profile for user {user_id}: {e}")
+        _record_failure(e)
+        return _build_profile(user_id, {}, loaded=False)
+
+
+async def save_thumbnail(user_id: int, photo_id: str, photo_unique_id: str = None) -> bool:
+    """Save or update user's thumbnail (photo_unique_id keys the result cache)"""
     if not DB_AVAILABLE:
         logger.debug(f"Database not available, skipping thumbnail save for user {user_id}")
         return False
     
     try:
-        users_collection.update_one(
-            {"user_id": user_id},
+        await _update_user(
+            user_id,
             {
-                "$set": {
-                    "user_id": user_id,
-                    "photo_id": photo_id,
-                    "updated_at": datetime.now()
-                }
+                "user_id": user_id,
+                "photo_id": photo_id,
+                "photo_unique_id": photo_unique_id,
+                "updated_at": datetime.now()
             },
             upsert=True
         )
@@ -52,190 +497,567 @@ def save_thumbnail(user_id: int, photo_id: str) -> bool:
         return True
     except Exception as e:
         logger.error(f"❌ Error saving thumbnail: {e}")
+        _record_failure(e)
         return False
 
 
-def get_thumbnail(user_id: int) -> str | None:
-    """Retrieve user's thumbnail from MongoDB"""
-    if not DB_AVAILABLE:
-        logger.debug(f"Database not available, cannot get thumbnail for user {user_id}")
-        return None
-    
-    try:
-        user_record = users_collection.find_one({"user_id": user_id})
-        if user_record and "photo_id" in user_record:
-            logger.info(f"✅ Retrieved thumbnail for user {user_id}")
-            return user_record["photo_id"]
+async def get_thumbnail(user_id: int) -> str | None:
+    """Retrieve user's thumbnail"""
+    photo_id = (await get_user_profile(user_id))["photo_id"]
+    if photo_id:
+        logger.info(f"✅ Retrieved thumbnail for user {user_id}")
+    else:
         logger.info(f"⚠️ No thumbnail found for user {user_id}")
-        return None
-    except Exception as e:
-        logger.error(f"❌ Error retrieving thumbnail: {e}")
-        return None
+    return photo_id
 
 
-def delete_thumbnail(user_id: int) -> bool:
-    """Delete user's thumbnail from MongoDB"""
+async def delete_thumbnail(user_id: int) -> bool:
+    """Delete user's thumbnail"""
     if not DB_AVAILABLE:
         logger.debug(f"Database not available, skipping thumbnail delete for user {user_id}")
         return False
     
     try:
-        result = users_collection.update_one(
-            {"user_id": user_id},
-            {"$unset": {"photo_id": ""}}
-        )
-        if result.modified_count > 0:
+        before = await _update_user(user_id, unset_fields=("photo_id", "photo_unique_id"))
+        if before and "photo_id" in before:
             logger.info(f"✅ Thumbnail deleted for user {user_id}")
             return True
         logger.info(f"⚠️ No thumbnail to delete for user {user_id}")
         return False
     except Exception as e:
         logger.error(f"❌ Error deleting thumbnail: {e}")
+        _record_failure(e)
         return False
 
 
-def has_thumbnail(user_id: int) -> bool:
+async def has_thumbnail(user_id: int) -> bool:
     """Check if user has a saved thumbnail"""
+    has_thumb = (await get_user_profile(user_id))["photo_id"] is not None
+    logger.debug(f"Thumbnail check for user {user_id}: {has_thumb}")
+    return has_thumb
+
+
+async def set_user_verified(user_id: int, verified: bool) -> bool:
+    """Persist the time a user passed force-sub verification, or clear it"""
     if not DB_AVAILABLE:
+        logger.debug(f"Database not available, skipping verification update for user {user_id}")
         return False
-    
+
     try:
-        user_record = users_collection.find_one({"user_id": user_id})
-        has_thumb = user_record is not None and "photo_id" in user_record
-        logger.debug(f"Thumbnail check for user {user_id}: {has_thumb}")
-        return has_thumb
+        if verified:
+            await _update_user(user_id, {"user_id": user_id, "verified_at": datetime.now()}, upsert=True)
+        else:
+            await _update_user(user_id, unset_fields=("verified_at",))
+        return True
     except Exception as e:
-        logger.error(f"❌ Error checking thumbnail: {e}")
+        logger.error(f"❌ Error updating verification for user {user_id}: {e}")
+        _record_failure(e)
         return False
 
 
 """═══════════════════ ADMIN FUNCTIONS ═══════════════════"""
 
 
-def ban_user(user_id: int, reason: str = "No reason") -> bool:
+async def ban_user(user_id: int, reason: str = "No reason") -> bool:
     """Ban a user from using the bot"""
     if not DB_AVAILABLE:
         logger.debug(f"Database not available, skipping ban for user {user_id}")
         return False
     
     try:
-        users_collection.update_one(
-            {"user_id": user_id},
+        await _update_user(
+            user_id,
             {
-                "$set": {
-                    "user_id": user_id,
-                    "is_banned": True,
-                    "ban_reason": reason,
-                    "banned_at": datetime.now()
-                }
+                "user_id": user_id,
+                "is_banned": True,
+                "ban_reason": reason,
+                "banned_at": datetime.now()
             },
             upsert=True
         )
+        _banned_ids.add(user_id)
         logger.info(f"🚫 User {user_id} banned. Reason: {reason}")
         return True
     except Exception as e:
         logger.error(f"❌ Error banning user {user_id}: {e}")
+        _record_failure(e)
         return False
 
 
-def unban_user(user_id: int) -> bool:
+async def unban_user(user_id: int) -> bool:
     """Unban a user"""
     if not DB_AVAILABLE:
         logger.debug(f"Database not available, skipping unban for user {user_id}")
         return False
     
     try:
-        result = users_collection.update_one(
-            {"user_id": user_id},
+        before = await _update_user(
+            user_id,
             {
-                "$set": {
-                    "is_banned": False,
-                    "unbanned_at": datetime.now()
-                }
+                "is_banned": False,
+                "unbanned_at": datetime.now()
             }
         )
-        if result.modified_count > 0:
+        if before is not None:
+            _banned_ids.discard(user_id)
             logger.info(f"✅ User {user_id} unbanned")
             return True
         logger.info(f"⚠️ User {user_id} not found")
         return False
     except Exception as e:
         logger.error(f"❌ Error unbanning user {user_id}: {e}")
+        _record_failure(e)
         return False
 
 
-def is_user_banned(user_id: int) -> bool:
-    """Check if user is banned"""
-    if not DB_AVAILABLE:
+async def is_user_banned(user_id: int) -> bool:
+    """Check if user is banned; a set lookup once the ban set is loaded"""
+    if _bans_loaded:
+        banned = user_id in _banned_ids
+    else:
+        banned = (await get_user_profile(user_id))["is_banned"]
+    if banned:
+        logger.debug(f"User {user_id} is banned")
+        return True
+    return False
+
+
+"""═══════════════════ BAN SET ═══════════════════"""
+
+
+def _is_banned(user_id: int, record: dict) -> bool:
+    if _bans_loaded:
+        return user_id in _banned_ids
+    return bool(record.get("is_banned", False))
+
+
+def _pending_ban(user_id: int) -> bool | None:
+    """Ban state of a queued write-behind update, or None if it does not touch is_banned"""
+    pending = _pending_writes.get(user_id)
+    if pending is None:
+        return None
+    if "is_banned" in pending["set"]:
+        return bool(pending["set"]["is_banned"])
+    if "is_banned" in pending["unset"]:
         return False
+    return None
+
+
+async def load_banned_ids() -> int:
+    """Replace the in-memory ban set with every banned user_id in the store"""
+    global _banned_ids, _bans_loaded
+
+    banned = {user_id async for user_id in storage.iter_banned_ids()}
+    for user_id in _pending_writes:
+        queued = _pending_ban(user_id)
+        if queued is True:
+            banned.add(user_id)
+        elif queued is False:
+            banned.discard(user_id)
+
+    if _bans_loaded and banned != _banned_ids:
+        logger.info(f"🚫 Ban set reloaded: {len(banned)} banned ({len(banned ^ _banned_ids)} changed)")
+    _banned_ids = banned
+    _bans_loaded = True
+    return len(banned)
+
+
+def _apply_ban_change(user_id: int, banned: bool) -> None:
+    """Apply a ban change reported by the change feed (another replica or a direct edit)"""
+    if _pending_ban(user_id) is not None:
+        # A queued local write is newer than anything the store can report
+        return
+    if (user_id in _banned_ids) == banned:
+        return
+    if banned:
+        _banned_ids.add(user_id)
+    else:
+        _banned_ids.discard(user_id)
+    # The cached record has a stale ban reason and timestamps
+    user_cache.pop(user_id)
+    logger.info(f"🚫 User {user_id} {'banned' if banned else 'unbanned'} elsewhere")
+
+
+async def _ban_sync_loop() -> None:
+    """Follow the backend's change feed; reload the set whenever the feed is unavailable"""
+    use_feed = True
+    while True:
+        if DB_AVAILABLE and use_feed:
+            try:
+                async for user_id, banned in storage.watch_bans():
+                    if user_id is None:
+                        await load_banned_ids()
+                    else:
+                        _apply_ban_change(user_id, banned)
+            except (ChangeFeedUnsupported, NotImplementedError) as e:
+                logger.info(f"🔄 No change feed ({e}); reloading bans every {BAN_SYNC_INTERVAL:g}s")
+                use_feed = False
+            except Exception as e:
+                logger.warning(f"⚠️ Ban change feed interrupted: {e}")
+
+        if DB_AVAILABLE:
+            # Polling mode, or catching up on changes made while the feed was down
+            try:
+                await load_banned_ids()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not reload banned users: {e}")
+        await asyncio.sleep(BAN_SYNC_INTERVAL)
+
+
+"""═══════════════════ STATS COUNTERS ═══════════════════"""
+
+
+def _stats_flags(record: dict | None) -> dict:
+    """Map a user document to its contribution to each stats counter"""
+    record = record or {}
+    return {
+        "total_users": 1 if record else 0,
+        "banned_users": 1 if record.get("is_banned", False) else 0,
+        "users_with_thumbnail": 1 if "photo_id" in record else 0,
+        "unreachable_users": 1 if record.get("unreachable", False) else 0
+    }
+
+
+async def _apply_stats_delta(before: dict | None, after: dict | None) -> None:
+    """Atomically adjust the counters document by the change between two user states"""
+    old, new = _stats_flags(before), _stats_flags(after)
+    delta = {key: new[key] - old[key] for key in STATS_KEYS if new[key] != old[key]}
+    if delta:
+        await _inc_stats(delta)
+
+
+async def _inc_stats(delta: dict) -> None:
+    """Add delta to the counters document (queued with the writes in write-behind mode)"""
+    if WRITE_MODE == "behind":
+        for key, value in delta.items():
+            _pending_stats[key] = _pending_stats.get(key, 0) + value
+        return
+
+    try:
+        await storage.inc_counters("user_stats", delta)
+    except Exception as e:
+        # Reconciliation repairs any drift left by a missed increment
+        logger.warning(f"⚠️ Could not update stats counters: {e}")
+        _record_failure(e)
+
+
+async def reconcile_stats() -> dict:
+    """Recount users from the store and overwrite the counters document"""
+    await flush_writes()
+    counted = await storage.count_users()
+    previous = await storage.set_counters("user_stats", counted) or {}
+
+    drift = {key: counted[key] - previous.get(key, 0) for key in STATS_KEYS if counted[key] != previous.get(key, 0)}
+    if drift:
+        logger.warning(f"⚠️ Stats counters drifted, corrected by {drift}")
+    logger.info(f"📊 Stats reconciled: {counted}")
+    return counted
+
+
+async def _reconcile_stats_loop() -> None:
+    """Periodically repair the counters document"""
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        if not DB_AVAILABLE:
+            continue
+        try:
+            await reconcile_stats()
+        except Exception as e:
+            logger.error(f"❌ Error reconciling stats: {e}")
+
+
+async def get_stats() -> dict:
+    """Get bot statistics"""
+    empty = {key: 0 for key in STATS_KEYS}
+    if not DB_AVAILABLE:
+        return empty
     
     try:
-        user_record = users_collection.find_one({"user_id": user_id})
-        if user_record and user_record.get("is_banned", False):
-            logger.debug(f"User {user_id} is banned")
-            return True
-        return False
+        counters = await storage.get_counters("user_stats")
+        if counters is None:
+            counters = await reconcile_stats()
+        # Include counter changes still waiting in the write-behind queue
+        stats = {key: max(counters.get(key, 0) + _pending_stats.get(key, 0), 0) for key in STATS_KEYS}
+        if _bans_loaded:
+            stats["banned_users"] = len(_banned_ids)
+        logger.info(f"📊 Stats: {stats}")
+        return stats
     except Exception as e:
-        logger.error(f"❌ Error checking ban status: {e}")
-        return False
+        logger.error(f"❌ Error getting stats: {e}")
+        _record_failure(e)
+        return empty
 
 
-def get_total_users() -> int:
+async def get_total_users() -> int:
     """Get total number of users"""
+    count = (await get_stats())["total_users"]
+    logger.info(f"📊 Total users: {count}")
+    return count
+
+
+async def get_banned_users_count() -> int:
+    """Get total number of banned users"""
+    if _bans_loaded:
+        count = len(_banned_ids)
+    else:
+        count = (await get_stats())["banned_users"]
+    logger.info(f"🚫 Total banned users: {count}")
+    return count
+
+
+def audience_filter(audience: str = "all") -> dict:
+    """Storage filter for a named audience (see AUDIENCES)"""
+    if audience == "all":
+        return {"reachable": True}
+    if audience == "cover":
+        return {"with_photo": True, "reachable": True}
+    if audience == "active":
+        return {"active_since": datetime.now() - timedelta(days=ACTIVE_USER_DAYS), "reachable": True}
+    raise ValueError(f"Unknown audience: {audience!r} (expected one of {', '.join(AUDIENCES)})")
+
+
+async def count_audience(audience: str = "all") -> int:
+    """Number of users iter_user_ids() yields for the audience"""
+    if audience == "all":
+        stats = await get_stats()
+        return max(stats["total_users"] - stats["unreachable_users"], 0)
     if not DB_AVAILABLE:
         return 0
-    
+
     try:
-        count = users_collection.count_documents({})
-        logger.info(f"📊 Total users: {count}")
-        return count
+        return await storage.count_audience(audience_filter(audience))
     except Exception as e:
-        logger.error(f"❌ Error counting users: {e}")
+        logger.error(f"❌ Error counting audience {audience}: {e}")
+        _record_failure(e)
         return 0
 
 
-def get_banned_users_count() -> int:
-    """Get total number of banned users"""
+async def iter_user_ids(after_id: int = None, audience: str = "all"):
+    """
+    Yield the user_id of every stored user in the audience in ascending order, starting
+    after after_id. Ids are streamed in keyset batches, never collected into one list.
+    """
     if not DB_AVAILABLE:
+        return
+
+    await flush_writes()
+    async for doc in storage.iter_users(fields=("user_id",), after_id=after_id, audience=audience_filter(audience)):
+        if "user_id" in doc:
+            yield doc["user_id"]
+
+
+"""═══════════════════ REACHABILITY ═══════════════════"""
+
+
+async def mark_unreachable(failures: list[tuple]) -> int:
+    """
+    Flag users a broadcast could not reach, given (user_id, reason) pairs, in one bulk
+    write. Flagged users are skipped by later broadcasts. Returns the number flagged.
+    """
+    if not DB_AVAILABLE or not failures:
         return 0
-    
+
+    now = datetime.now()
+    updates = [
+        (user_id, {"unreachable": True, "unreachable_reason": reason, "unreachable_at": now}, (), False)
+        for user_id, reason in failures
+    ]
     try:
-        count = users_collection.count_documents({"is_banned": True})
-        logger.info(f"🚫 Total banned users: {count}")
-        return count
+        if WRITE_MODE == "behind":
+            flagged = 0
+            for user_id, set_fields, _, _ in updates:
+                before = await _queue_user_update(user_id, set_fields, (), False)
+                flagged += before is not None and not before.get("unreachable")
+            return flagged
+
+        # Users already flagged (or unknown) are not written, so the counter moves by
+        # exactly the number of users that became unreachable
+        flagged = await storage.bulk_update_users(updates, unless="unreachable")
+        _record_success()
     except Exception as e:
-        logger.error(f"❌ Error counting banned users: {e}")
+        logger.error(f"❌ Error flagging {len(failures)} unreachable users: {e}")
+        _record_failure(e)
         return 0
 
+    for user_id, set_fields, _, _ in updates:
+        record = user_cache.peek(user_id)
+        if record is not None:
+            user_cache.set(user_id, _apply_fields(record, set_fields, (), False))
+        _publish_user_change(user_id, set_fields)
 
-def get_stats() -> dict:
-    """Get bot statistics"""
+    if flagged:
+        await _inc_stats({"unreachable_users": flagged})
+    logger.info(f"📵 Flagged {flagged} unreachable users")
+    return flagged
+
+
+async def mark_reachable(user_id: int) -> bool:
+    """Clear the unreachable flag of a user who contacted the bot again"""
     if not DB_AVAILABLE:
-        return {
-            "total_users": 0,
-            "banned_users": 0,
-            "users_with_thumbnail": 0
-        }
-    
+        return False
+
     try:
-        total = users_collection.count_documents({})
-        banned = users_collection.count_documents({"is_banned": True})
-        with_thumb = users_collection.count_documents({"photo_id": {"$exists": True}})
-        
-        stats = {
-            "total_users": total,
-            "banned_users": banned,
-            "users_with_thumbnail": with_thumb
-        }
-        logger.info(f"📊 Stats: {stats}")
-        return stats
+        if not (await _get_user_record(user_id)).get("unreachable"):
+            return False
+        await _update_user(user_id, unset_fields=UNREACHABLE_FIELDS)
+        logger.info(f"📶 User {user_id} is reachable again")
+        return True
     except Exception as e:
-        logger.error(f"❌ Error getting stats: {e}")
-        return {
-            "total_users": 0,
-            "banned_users": 0,
-            "users_with_thumbnail": 0
-        }
+        logger.error(f"❌ Error clearing unreachable flag for user {user_id}: {e}")
+        _record_failure(e)
+        return False
+
+
+async def get_reachability() -> dict:
+    """Audience size for broadcasts: total, reachable and unreachable users"""
+    stats = await get_stats()
+    total, unreachable = stats["total_users"], stats["unreachable_users"]
+    reachable = max(total - unreachable, 0)
+    return {
+        "total": total,
+        "reachable": reachable,
+        "unreachable": unreachable,
+        "reachable_ratio": reachable / total if total else 1.0
+    }
+
+
+"""═══════════════════ RESULT CACHE ═══════════════════"""
+
+
+async def get_cached_result(key: str) -> dict | None:
+    """Covered output for a result key from memory, then (if enabled) the database"""
+    global _result_db_hits
+
+    result = result_cache.get(key)
+    if result is not None or not RESULT_CACHE_DB or not DB_AVAILABLE:
+        return result
+
+    try:
+        result = await storage.get_result(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read cached result: {e}")
+        _record_failure(e)
+        return None
+    if result is not None:
+        _result_db_hits += 1
+        result_cache.set(key, result)
+    return result
+
+
+async def cache_result(key: str, video_id: str, cover_id: str) -> None:
+    """Remember the covered output sent for a result key"""
+    result = {"video": video_id, "cover": cover_id}
+    result_cache.set(key, result)
+    if not RESULT_CACHE_DB or not DB_AVAILABLE:
+        return
+
+    try:
+        await storage.put_result(key, result)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not store cached result: {e}")
+        _record_failure(e)
+
+
+def forget_cached_result(key: str) -> None:
+    """Drop a result Telegram no longer accepts; the caller's fresh result then replaces the database copy"""
+    result_cache.pop(key)
+
+
+def get_result_cache_stats() -> dict:
+    """Hit ratio across memory and database lookups"""
+    stats = result_cache.stats()
+    hits = stats["hits"] + _result_db_hits
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "size": stats["size"],
+        "hits": hits,
+        "misses": lookups - hits,
+        "hit_ratio": hits / lookups if lookups else 0.0,
+        "persistent": RESULT_CACHE_DB
+    }
+
+
+"""═══════════════════ BROADCAST JOBS ═══════════════════"""
+
+
+async def save_broadcast_job(job_id: str, fields: dict) -> bool:
+    """Create a broadcast job document or update its fields"""
+    if not DB_AVAILABLE:
+        return False
+
+    try:
+        await storage.save_job(job_id, {**fields, "updated_at": datetime.now()})
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error saving broadcast job {job_id}: {e}")
+        _record_failure(e)
+        return False
+
+
+async def get_broadcast_job(job_id: str) -> dict | None:
+    if not DB_AVAILABLE:
+        return None
+
+    try:
+        return await storage.get_job(job_id)
+    except Exception as e:
+        logger.error(f"❌ Error loading broadcast job {job_id}: {e}")
+        _record_failure(e)
+        return None
+
+
+async def claim_broadcast_job(job_id: str, owner: str, lease_seconds: float) -> dict | None:
+    """Take over a job whose owner is gone (no heartbeat for lease_seconds)"""
+    if not DB_AVAILABLE:
+        return None
+
+    try:
+        stale_before = datetime.now() - timedelta(seconds=lease_seconds)
+        return await storage.claim_job(job_id, owner, stale_before)
+    except Exception as e:
+        logger.error(f"❌ Error claiming broadcast job {job_id}: {e}")
+        _record_failure(e)
+        return None
+
+
+async def list_broadcast_jobs(states=None, limit: int = 20) -> list[dict]:
+    """Newest broadcast jobs first, optionally filtered by state"""
+    if not DB_AVAILABLE:
+        return []
+
+    try:
+        return await storage.list_jobs(states, limit)
+    except Exception as e:
+        logger.error(f"❌ Error listing broadcast jobs: {e}")
+        _record_failure(e)
+        return []
+
+
+async def record_broadcast_deliveries(job_id: str, results: list[tuple]) -> bool:
+    """Store a batch of (user_id, outcome) results for a job; False means retry later"""
+    if not DB_AVAILABLE:
+        return False
+
+    try:
+        await storage.record_deliveries(job_id, results)
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error recording {len(results)} broadcast deliveries: {e}")
+        _record_failure(e)
+        return False
+
+
+async def get_delivered_ids(job_id: str, after_id: int = None) -> set:
+    """User ids already handled by a job above its checkpoint (raises so a resume never re-sends)"""
+    return await storage.delivered_ids(job_id, after_id)
+
+
+async def clear_broadcast_deliveries(job_id: str) -> None:
+    """Drop per-user bookkeeping of a finished job"""
+    try:
+        await storage.delete_deliveries(job_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not clear deliveries of broadcast job {job_id}: {e}")
 
 
 """═══════════════════ LOGGING FUNCTIONS ═══════════════════"""
@@ -0,0 +1,339 @@
+"""
+Force-Subscribe Membership Module for Video Cover Bot
+Tracks force-sub channel membership from chat_member updates and caches
+get_chat_member results, so verified users are not re-checked against the
+channel on every message. Verification itself is persisted on the user
+document so restarts do not send everyone back through the join prompt, and
+the join prompt is served from cached channel metadata and pooled invite links.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from telegram.constants import ChatMemberStatus
+from telegram.error import RetryAfter
+from cache import TTLCache, single_flight
+from database import get_user_profile, set_user_verified
+from invalidation import bus
+from ratelimit import retry_after_seconds
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Seconds a membership result is trusted: members are re-checked at most every
+# MEMBERSHIP_TTL, non-members (negative results) sooner so joining takes effect quickly
+MEMBERSHIP_TTL = float(os.environ.get("MEMBERSHIP_TTL", "600"))
+MEMBERSHIP_NEGATIVE_TTL = float(os.environ.get("MEMBERSHIP_NEGATIVE_TTL", "60"))
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", "100000"))
+
+# When the bot is a channel admin Telegram pushes join/leave events, so results are kept
+# until this periodic reconciliation re-checks them with get_chat_member
+MEMBERSHIP_RECONCILE_INTERVAL = float(os.environ.get("MEMBERSHIP_RECONCILE_INTERVAL", "21600"))
+
+# A verification stays valid this long, after which the user taps verify again
+VERIFIED_EXPIRY_DAYS = float(os.environ.get("VERIFIED_EXPIRY_DAYS", "30"))
+
+# Verified state kept in memory; evicted or expired entries are re-read from the user profile
+VERIFIED_CACHE_SIZE = int(os.environ.get("VERIFIED_CACHE_SIZE", "100000"))
+VERIFIED_CACHE_TTL = float(os.environ.get("VERIFIED_CACHE_TTL", "3600"))
+
+# Channel title/username are re-fetched with get_chat this often
+CHANNEL_INFO_REFRESH = float(os.environ.get("CHANNEL_INFO_REFRESH", "3600"))
+
+# Private channels without a primary link get single-use invite links; this many are kept
+# ready and refilled in the background. A user who is prompted again reuses their link.
+INVITE_POOL_SIZE = int(os.environ.get("INVITE_POOL_SIZE", "20"))
+INVITE_LINK_TTL = float(os.environ.get("INVITE_LINK_TTL", "3600"))
+INVITE_RETRY_LIMIT = 3
+
+MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# user_id -> True (member) / False (not a member)
+membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_TTL)
+
+# user_id -> True (verified) / False (not verified or expired)
+verified_users = TTLCache(maxsize=VERIFIED_CACHE_SIZE, ttl=VERIFIED_CACHE_TTL)
+
+# Calls actually made to get_chat_member, and join/leave events received
+_api_checks = 0
+_member_events = 0
+
+# True once the bot is confirmed as a channel admin, i.e. chat_member updates will arrive
+_event_feed = False
+
+
+def parse_channel_id(value):
+    """Numeric chat id when the setting is one, otherwise the @username as given"""
+    value = str(value).strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def is_channel(chat, channel_id) -> bool:
+    """Whether a Chat is the configured force-sub channel"""
+    if isinstance(channel_id, int):
+        return chat.id == channel_id
+    return bool(chat.username) and chat.username.lower() == channel_id.lstrip("@").lower()
+
+
+def _membership_ttl(joined: bool) -> float:
+    if _event_feed:
+        return MEMBERSHIP_RECONCILE_INTERVAL
+    return MEMBERSHIP_TTL if joined else MEMBERSHIP_NEGATIVE_TTL
+
+
+def remember_membership(user_id: int, joined: bool) -> None:
+    """Record a membership result with the TTL for its kind"""
+    membership_cache.set(user_id, joined, ttl=_membership_ttl(joined))
+
+
+def record_member_event(user_id: int, status) -> bool:
+    """Apply a join/leave seen in a chat_member update; returns whether the user is now a member"""
+    global _member_events
+
+    _member_events += 1
+    joined = status in MEMBER_STATUSES
+    remember_membership(user_id, joined)
+    return joined
+
+
+async def enable_event_feed(bot, channel_id) -> bool:
+    """
+    Check whether Telegram will send chat_member updates for the channel (the bot must be
+    an admin there). Without them, results fall back to the short polling TTLs.
+    """
+    global _event_feed
+
+    try:
+        me = await bot.get_chat_member(chat_id=channel_id, user_id=bot.id)
+        _event_feed = me.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not check bot rights in force-sub channel: {e}")
+        _event_feed = False
+
+    if _event_feed:
+        logger.info(f"📡 Tracking channel joins/leaves, reconciling every {MEMBERSHIP_RECONCILE_INTERVAL:g}s")
+    else:
+        logger.info(f"🔍 Bot is not a channel admin, polling membership every {MEMBERSHIP_TTL:g}s")
+    return _event_feed
+
+
+def forget_membership(user_id: int) -> None:
+    membership_cache.pop(user_id)
+
+
+async def is_member(bot, channel_id, user_id: int, use_cache: bool = True) -> bool:
+    """
+    Check whether a user is in the force-sub channel, answering from the cache while the
+    last result is fresh. Raises if Telegram cannot be asked; failures are never cached.
+    """
+    if use_cache:
+        cached = membership_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    # A burst of messages from one user shares a single get_chat_member call
+    return await single_flight.do(("membership", user_id), lambda: _fetch_membership(bot, channel_id, user_id))
+
+
+async def _fetch_membership(bot, channel_id, user_id: int) -> bool:
+    global _api_checks
+
+    member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+    _api_checks += 1
+    joined = member.status in MEMBER_STATUSES
+    logger.debug(f"📊 Member status for {user_id}: {member.status}")
+    remember_membership(user_id, joined)
+    return joined
+
+
+def get_membership_stats() -> dict:
+    """Cache counters for admin screens; every hit is a get_chat_member call saved"""
+    stats = membership_cache.stats()
+    return {
+        **stats,
+        "checks_saved": stats["hits"],
+        "api_checks": _api_checks,
+        "events": _member_events,
+        "event_feed": _event_feed
+    }
+
+
+"""═══════════════════ VERIFIED USERS ═══════════════════"""
+
+
+def _verification_valid(verified_at) -> bool:
+    return verified_at is not None and datetime.now() - verified_at < timedelta(days=VERIFIED_EXPIRY_DAYS)
+
+
+async def is_verified(user_id: int) -> bool:
+    """Whether a user has a valid verification; loaded from their profile on first use"""
+    verified = verified_users.get(user_id)
+    if verified is None:
+        profile = await get_user_profile(user_id)
+        verified = _verification_valid(profile["verified_at"])
+        # Defaults from an unreachable database are no verdict; ask again once it is back
+        if profile["loaded"]:
+            verified_users.set(user_id, verified)
+    return verified
+
+
+async def set_verified(user_id: int, verified: bool) -> None:
+    """Record or revoke verification here, in the database and on every other bot worker"""
+    verified_users.set(user_id, verified)
+    await set_user_verified(user_id, verified)
+    bus.publish("verified", user_id, {"verified": verified})
+
+
+def _on_verified_invalidated(user_id: int, data: dict) -> None:
+    # Another worker just asked Telegram, so its answer replaces our cached membership
+    verified = bool(data.get("verified"))
+    verified_users.set(user_id, verified)
+    if verified:
+        remember_membership(user_id, True)
+    else:
+        forget_membership(user_id)
+
+
+bus.subscribe("verified", _on_verified_invalidated)
+
+
+"""═══════════════════ CHANNEL METADATA & INVITE LINKS ═══════════════════"""
+
+
+# Last get_chat result for the force-sub channel
+_channel = {"id": None, "name": None, "username": None, "link": None, "fetched_at": 0.0}
+
+# Ready-made single-use links, and the link each prompted user was given
+_invite_pool = deque()
+_user_links = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=INVITE_LINK_TTL)
+_refill_wakeup = asyncio.Event()
+_pool_task = None
+
+
+async def get_channel_info(bot, channel_id) -> dict:
+    """
+    Channel name and public link (None for private channels without a primary link),
+    fetched at most every CHANNEL_INFO_REFRESH seconds. A failed refresh keeps the last result.
+    """
+    fresh = time.monotonic() - _channel["fetched_at"] < CHANNEL_INFO_REFRESH
+    if _channel["id"] == channel_id and fresh:
+        return _channel
+
+    try:
+        chat = await bot.get_chat(channel_id)
+    except Exception as e:
+        if _channel["id"] != channel_id:
+            raise
+        logger.warning(f"⚠️ Could not refresh channel info, keeping cached: {e}")
+        _channel["fetched_at"] = time.monotonic()
+        return _channel
+
+    link = None
+    if chat.username:
+        link = f"https://t.me/{chat.username}"
+    elif getattr(chat, "invite_link", None):
+        link = chat.invite_link
+    _channel.update({
+        "id": channel_id,
+        "name": chat.title or chat.username or "Channel",
+        "username": chat.username,
+        "link": link,
+        "fetched_at": time.monotonic()
+    })
+    logger.info(f"✅ Force-sub channel: {_channel['name']}")
+    return _channel
+
+
+async def create_invite_link(bot, channel_id) -> str | None:
+    """Create a single-use invite link, waiting out flood control up to INVITE_RETRY_LIMIT times"""
+    for attempt in range(1, INVITE_RETRY_LIMIT + 1):
+        try:
+            link_obj = await bot.create_chat_invite_link(chat_id=channel_id, member_limit=1)
+            # Different objects may expose either 'invite_link' attribute or be a string
+            return getattr(link_obj, "invite_link", link_obj)
+        except RetryAfter as e:
+            if attempt == INVITE_RETRY_LIMIT:
+                logger.warning(f"Rate limited while creating invite link, giving up after {attempt} tries")
+                return None
+            secs = retry_after_seconds(e)
+            logger.info(f"Rate limited while creating invite link: sleeping {secs:g}s")
+            await asyncio.sleep(secs)
+        except Exception as e:
+            logger.warning(f"Could not create invite link: {e}")
+            return None
+    return None
+
+
+def _fallback_link(channel_id) -> str:
+    if str(channel_id).startswith("-100"):
+        return f"https://t.me/c/{str(channel_id)[4:]}"
+    return f"https://t.me/{str(channel_id).lstrip('@')}"
+
+
+async def get_join_link(bot, channel_id, user_id: int) -> str:
+    """Join URL for a prompt: the public link, the user's earlier link, or one from the pool"""
+    channel = await get_channel_info(bot, channel_id)
+    if channel["link"]:
+        return channel["link"]
+
+    link = _user_links.get(user_id)
+    if link is None:
+        link = await single_flight.do(("invite_link", user_id), lambda: _assign_invite_link(bot, channel_id, user_id))
+    return link or _fallback_link(channel_id)
+
+
+async def _assign_invite_link(bot, channel_id, user_id: int) -> str | None:
+    if _invite_pool:
+        link = _invite_pool.popleft()
+        _refill_wakeup.set()
+    else:
+        link = await create_invite_link(bot, channel_id)
+    if link is not None:
+        _user_links.set(user_id, link)
+    return link
+
+
+async def _invite_pool_loop(bot, channel_id) -> None:
+    """Keep INVITE_POOL_SIZE links ready while the channel needs single-use links"""
+    while True:
+        try:
+            channel = await get_channel_info(bot, channel_id)
+            while not channel["link"] and len(_invite_pool) < INVITE_POOL_SIZE:
+                link = await create_invite_link(bot, channel_id)
+                if link is None:
+                    break
+                _invite_pool.append(link)
+        except Exception as e:
+            logger.warning(f"⚠️ Invite pool refill failed: {e}")
+
+        try:
+            await asyncio.wait_for(_refill_wakeup.wait(), timeout=CHANNEL_INFO_REFRESH)
+        except asyncio.TimeoutError:
+            pass
+        _refill_wakeup.clear()
+
+
+async def start_invite_pool(bot, channel_id) -> None:
+    """Resolve the channel once at startup and start filling the invite pool"""
+    global _pool_task
+
+    try:
+        await get_channel_info(bot, channel_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not resolve force-sub channel {channel_id}: {e}")
+    if INVITE_POOL_SIZE > 0:
+        _pool_task = asyncio.create_task(_invite_pool_loop(bot, channel_id))
+
+
+def stop_invite_pool() -> None:
+    global _pool_task
+
+    if _pool_task is not None:
+        _pool_task.cancel()
+        _pool_task = None
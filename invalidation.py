@@ -0,0 +1,226 @@
+"""
+Invalidation Bus for Video Cover Bot
+Broadcasts per-user change events between bot workers so each one can keep aggressive
+in-process caches (user records, verified users, ban set) without serving stale state
+
+Every event is {"scope", "user_id", "data", "origin"}. A worker never receives its own
+events: it already updated its local state when it made the change.
+"""
+
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# "local" (single worker, in-memory) or "mongo" (capped collection shared by all workers)
+INVALIDATION_TRANSPORT = os.environ.get("INVALIDATION_TRANSPORT", "local").strip().lower()
+INVALIDATION_COLLECTION = os.environ.get("INVALIDATION_COLLECTION", "invalidations")
+INVALIDATION_COLLECTION_BYTES = int(os.environ.get("INVALIDATION_COLLECTION_BYTES", str(16 * 1024 * 1024)))
+
+# Seconds to wait before reopening a failed transport feed
+INVALIDATION_RETRY_DELAY = 2.0
+
+
+"""═══════════════════ TRANSPORTS ═══════════════════"""
+
+
+class LocalTransport:
+    """In-memory transport; buses sharing one instance see each other's events (tests, single process)"""
+
+    name = "local"
+
+    def __init__(self):
+        self._queues = []
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def send(self, events: list[dict]) -> None:
+        for queue in self._queues:
+            for event in events:
+                queue.put_nowait(event)
+
+    async def receive(self):
+        queue = asyncio.Queue()
+        self._queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.remove(queue)
+
+
+class MongoTransport:
+    """
+    Capped MongoDB collection followed with a tailable cursor. Unlike change streams this
+    also works on a standalone server; the cap keeps the collection from growing.
+    """
+
+    name = "mongo"
+
+    def __init__(self, uri: str, database: str, collection: str = INVALIDATION_COLLECTION,
+                 size_bytes: int = INVALIDATION_COLLECTION_BYTES):
+        self.uri = uri
+        self.database_name = database
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.client = None
+        self.collection = None
+        self._last_id = None
+
+    async def open(self) -> None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo.errors import CollectionInvalid
+
+        self.client = AsyncIOMotorClient(self.uri, maxPoolSize=4, serverSelectionTimeoutMS=5000)
+        db = self.client[self.database_name]
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # already created by another worker
+        self.collection = db[self.collection_name]
+
+        # Only events published after this worker started are of interest
+        newest = await self.collection.find_one({}, sort=[("$natural", -1)])
+        self._last_id = newest["_id"] if newest else None
+
+    async def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+
+    async def send(self, events: list[dict]) -> None:
+        now = datetime.now()
+        await self.collection.insert_many([{**event, "at": now} for event in events], ordered=False)
+
+    async def receive(self):
+        from pymongo import CursorType
+
+        while True:
+            query = {"_id": {"$gt": self._last_id}} if self._last_id is not None else {}
+            cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for doc in cursor:
+                    self._last_id = doc["_id"]
+                    yield doc
+            # A tailable cursor on an empty collection dies at once; poll until the first event
+            await asyncio.sleep(1)
+
+
+def create_transport(name: str = None):
+    """Build the configured transport; settings are read from the environment at call time"""
+    name = (name or os.environ.get("INVALIDATION_TRANSPORT", INVALIDATION_TRANSPORT)).strip().lower()
+    if name == "local":
+        return LocalTransport()
+    if name == "mongo":
+        return MongoTransport(
+            os.environ.get("MONGODB_URI", "mongodb://localhost:27017"),
+            os.environ.get("MONGODB_DATABASE", "video_cover_bot"),
+            os.environ.get("INVALIDATION_COLLECTION", INVALIDATION_COLLECTION)
+        )
+    raise ValueError(f"Unknown INVALIDATION_TRANSPORT: {name!r} (expected 'local' or 'mongo')")
+
+
+"""═══════════════════ BUS ═══════════════════"""
+
+
+class InvalidationBus:
+    """Fire-and-forget publisher plus a dispatcher that runs subscribers for other workers' events"""
+
+    def __init__(self):
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.transport = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self._handlers = {}
+        self._outbox = []
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def subscribe(self, scope: str, handler) -> None:
+        """Register handler(user_id, data) for events of one scope published by other workers"""
+        self._handlers.setdefault(scope, []).append(handler)
+
+    def publish(self, scope: str, user_id: int, data: dict = None) -> None:
+        """Queue an event for the other workers; never blocks the caller"""
+        if self.transport is None:
+            return
+        self._outbox.append({"scope": scope, "user_id": user_id, "data": data or {}, "origin": self.origin})
+        self._wakeup.set()
+
+    async def start(self, transport=None) -> None:
+        """Open the transport and start the sender and receiver tasks"""
+        transport = transport or create_transport()
+        try:
+            await transport.open()
+        except Exception as e:
+            logger.warning(f"⚠️ Invalidation transport '{transport.name}' unavailable, using local: {e}")
+            transport = LocalTransport()
+        self.transport = transport
+        self._tasks = [asyncio.create_task(self._send_loop()), asyncio.create_task(self._receive_loop())]
+        logger.info(f"📡 Invalidation bus started ({transport.name}, origin {self.origin})")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.transport is not None:
+            if self._outbox:
+                await self._send_batch()
+            await self.transport.close()
+            self.transport = None
+
+    async def _send_batch(self) -> None:
+        batch, self._outbox = self._outbox, []
+        try:
+            await self.transport.send(batch)
+            self.published += len(batch)
+        except Exception as e:
+            # Other workers fall back on their cache TTLs for these users
+            self.dropped += len(batch)
+            logger.warning(f"⚠️ Could not publish {len(batch)} invalidations: {e}")
+
+    async def _send_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._outbox:
+                await self._send_batch()
+
+    async def _receive_loop(self) -> None:
+        while True:
+            try:
+                async for event in self.transport.receive():
+                    if event.get("origin") != self.origin:
+                        self._dispatch(event)
+            except Exception as e:
+                logger.warning(f"⚠️ Invalidation feed interrupted, reopening: {e}")
+            await asyncio.sleep(INVALIDATION_RETRY_DELAY)
+
+    def _dispatch(self, event: dict) -> None:
+        self.received += 1
+        for handler in self._handlers.get(event.get("scope"), []):
+            try:
+                handler(event.get("user_id"), event.get("data") or {})
+            except Exception as e:
+                logger.error(f"❌ Invalidation handler failed for {event.get('scope')}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "transport": self.transport.name if self.transport else "-",
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+
+# Process-wide bus shared by database.py and bot.py
+bus = InvalidationBus()
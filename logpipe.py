@@ -0,0 +1,193 @@
+"""
+Log Channel Pipeline for Video Cover Bot
+Handlers hand log events to a bounded in-memory queue and return at once; one sender task
+delivers them to the log channel within Telegram's per-channel limit (about 20 messages a
+minute). Text events that pile up are merged into digest messages, and video copies are
+dropped first when the channel cannot keep up.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from functools import partial
+from telegram.error import RetryAfter
+from ratelimit import TokenBucket, retry_after_seconds
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Messages per minute sent to the log channel, and how many may go out back to back
+LOG_CHANNEL_RATE = float(os.environ.get("LOG_CHANNEL_RATE", "18"))
+LOG_CHANNEL_BURST = int(os.environ.get("LOG_CHANNEL_BURST", "3"))
+
+# Pending text events kept; the oldest routine event is dropped when full
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "1000"))
+
+# Pending media copies (logged videos) kept; new ones are dropped while this many wait
+LOG_MEDIA_BACKLOG = int(os.environ.get("LOG_MEDIA_BACKLOG", "20"))
+
+# Seconds stop() waits for queued text events to go out before giving up on them
+LOG_DRAIN_TIMEOUT = float(os.environ.get("LOG_DRAIN_TIMEOUT", "5"))
+
+# Telegram's limit for one text message
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n┈┈┈┈┈┈┈┈\n\n"
+
+
+async def send_text(bot, chat_id, text: str) -> None:
+    await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+
+
+class LogPipeline:
+    """Non-blocking, rate-limited writer to one log channel"""
+
+    def __init__(self, chat_id=None, rate_per_minute: float = LOG_CHANNEL_RATE, burst: int = LOG_CHANNEL_BURST,
+                 queue_size: int = LOG_QUEUE_SIZE, media_backlog: int = LOG_MEDIA_BACKLOG):
+        self.chat_id = chat_id
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.queue_size = queue_size
+        self.media_backlog = media_backlog
+        self.bot = None
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+        # Important events (admin actions) go out before routine ones
+        self._important = deque()
+        self._routine = deque()
+        # Coroutine functions send(bot, chat_id) for media copies
+        self._media = deque()
+        # Media dropped since the last text message, reported in the next one
+        self._unreported_drops = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.chat_id)
+
+    def post(self, text: str, important: bool = False) -> bool:
+        """Queue a text event; never blocks. Returns False when logging is off."""
+        if not self.enabled:
+            return False
+        if len(self._important) + len(self._routine) >= self.queue_size:
+            if not self._routine:
+                self.dropped += 1
+                return False
+            self._routine.popleft()
+            self.dropped += 1
+        (self._important if important else self._routine).append(text)
+        self._wakeup.set()
+        return True
+
+    def post_media(self, send) -> bool:
+        """
+        Queue a media copy; send(bot, chat_id) makes the actual call. These are the lowest
+        priority: dropped while the backlog is full, and only sent when no text is waiting.
+        """
+        if not self.enabled:
+            return False
+        if len(self._media) >= self.media_backlog:
+            self.dropped += 1
+            self._unreported_drops += 1
+            return False
+        self._media.append(send)
+        self._wakeup.set()
+        return True
+
+    def start(self, bot) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self.bot = bot
+        self._task = asyncio.create_task(self._send_loop())
+        logger.info(f"🧾 Log pipeline started ({self.bucket.rate * 60:g} msg/min to {self.chat_id})")
+
+    async def stop(self, timeout: float = LOG_DRAIN_TIMEOUT) -> None:
+        """Give the sender up to `timeout` seconds to send queued text events, then stop it"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._important or self._routine or self._unreported_drops) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        pending = len(self._important) + len(self._routine) + len(self._media)
+        if pending:
+            logger.warning(f"⚠️ {pending} log channel events not sent before shutdown")
+
+    def _next_digest(self) -> tuple[str, tuple]:
+        """
+        Pop as many waiting texts as fit in one message, important first. Also returns what
+        was popped, (important, routine, drops), so _restore() can put it back.
+        """
+        popped = ([], [])
+        parts, size = [], 0
+        for queue, taken in zip((self._important, self._routine), popped):
+            while queue:
+                extra = len(queue[0]) + (len(DIGEST_SEPARATOR) if parts else 0)
+                if parts and size + extra > MESSAGE_LIMIT - 100:
+                    break
+                taken.append(queue.popleft())
+                parts.append(taken[-1][:MESSAGE_LIMIT - 100])
+                size += extra
+        count = len(parts)
+        drops, self._unreported_drops = self._unreported_drops, 0
+        if drops:
+            parts.append(f"⚠️ {drops} ᴠɪᴅᴇᴏ ʟᴏɢs sᴋɪᴘᴘᴇᴅ (ʟᴏɢ ᴄʜᴀɴɴᴇʟ ʀᴀᴛᴇ ʟɪᴍɪᴛ)")
+        text = DIGEST_SEPARATOR.join(parts)
+        if count > 1:
+            text = f"🧾 <b>{count} ᴇᴠᴇɴᴛs</b>\n\n{text}"
+        return text, (*popped, drops)
+
+    def _restore(self, popped: tuple) -> None:
+        """Put a digest that could not be sent back in front of everything queued since"""
+        important, routine, drops = popped
+        self._important.extendleft(reversed(important))
+        self._routine.extendleft(reversed(routine))
+        self._unreported_drops += drops
+
+    async def _send_loop(self) -> None:
+        while True:
+            if not (self._important or self._routine or self._media or self._unreported_drops):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self.bucket.acquire()
+
+            # Texts that arrived while waiting for the token all share this one message
+            if self._important or self._routine or self._unreported_drops:
+                text, popped = self._next_digest()
+                count = len(popped[0]) + len(popped[1])
+                send = partial(send_text, text=text)
+            else:
+                popped, count = None, 1
+                send = self._media.popleft()
+
+            try:
+                await send(self.bot, self.chat_id)
+                self.sent += 1
+                self.merged += max(0, count - 1)
+            except RetryAfter as e:
+                secs = retry_after_seconds(e)
+                logger.warning(f"⏳ Log channel flood-limited, pausing {secs:g}s")
+                self.bucket.pause(secs)
+                # Put the events back; they merge into a bigger digest after the pause
+                if popped is not None:
+                    self._restore(popped)
+                else:
+                    self._media.appendleft(send)
+            except Exception as e:
+                self.failed += count
+                logger.error(f"❌ Error sending to log channel: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._important) + len(self._routine),
+            "media_queued": len(self._media),
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
@@ -0,0 +1,59 @@
+"""
+Rate Limiting Helpers for Video Cover Bot
+Token bucket shared by senders that must stay under a Telegram limit, and the wait a
+RetryAfter (flood control) error asks for.
+"""
+
+import time
+import asyncio
+from datetime import timedelta
+from telegram.error import RetryAfter
+
+# Wait used when Telegram's RetryAfter carries no duration
+DEFAULT_RETRY_AFTER = 30
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait until a send is allowed"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (flood control) and start again from empty"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        # Refill starts when the pause ends; the pause itself earns no tokens
+        self._updated = self._paused_until
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        return float(DEFAULT_RETRY_AFTER)
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
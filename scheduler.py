@@ -0,0 +1,278 @@
+"""
+Fair Job Scheduler for Video Cover Bot
+Runs per-user jobs (cover application) under a global concurrency limit, taking turns
+between users round-robin so one user's burst of forwards cannot starve everyone else.
+Videos of one album or burst are first collected so they can be sent as one media group.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Jobs running at once across all users, and at once for a single user
+VIDEO_CONCURRENCY = int(os.environ.get("VIDEO_CONCURRENCY", "8"))
+VIDEO_PER_USER_CONCURRENCY = int(os.environ.get("VIDEO_PER_USER_CONCURRENCY", "1"))
+
+# Jobs one user may have waiting; further submissions are refused until the queue drains
+VIDEO_QUEUE_LIMIT = int(os.environ.get("VIDEO_QUEUE_LIMIT", "100"))
+
+# Recent queue waits kept for the latency percentiles in stats()
+WAIT_SAMPLES = 1000
+
+# Videos of an album, or sent by one user less than VIDEO_BATCH_WINDOW seconds apart, are
+# delivered together in media groups; Telegram allows at most 10 items per group
+VIDEO_BATCH_WINDOW = float(os.environ.get("VIDEO_BATCH_WINDOW", "1.5"))
+MEDIA_GROUP_LIMIT = 10
+
+
+class QueueFull(Exception):
+    """The user already has VIDEO_QUEUE_LIMIT jobs waiting"""
+
+
+def percentile(samples, p: float) -> float:
+    """p-th quantile (0..1) of a collection of numbers; 0.0 when empty"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+class LatencyStats:
+    """Recent latency samples per label (e.g. delivery mode), summarized as count/p50/p95"""
+
+    def __init__(self, samples: int = WAIT_SAMPLES):
+        self.samples = samples
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, label: str, seconds: float) -> None:
+        self._samples.setdefault(label, deque(maxlen=self.samples)).append(seconds)
+        self._counts[label] = self._counts.get(label, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            label: {"count": self._counts[label], "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            for label, values in self._samples.items()
+        }
+
+
+class FairScheduler:
+    """
+    Per-user FIFO queues served round-robin by `concurrency` workers. A user gets at most
+    `per_user` jobs running at once; after one of their jobs starts they go to the back
+    of the line, so with many users waiting each one advances one job per turn.
+    """
+
+    def __init__(self, concurrency: int = VIDEO_CONCURRENCY, per_user: int = VIDEO_PER_USER_CONCURRENCY,
+                 queue_limit: int = VIDEO_QUEUE_LIMIT):
+        self.concurrency = max(1, concurrency)
+        self.per_user = max(1, per_user)
+        self.queue_limit = queue_limit
+        self.completed = 0
+        self.failed = 0
+        # user_id -> deque of (submitted_at, job); users with waiting jobs, in turn order
+        self._queues = {}
+        self._turns = deque()
+        # user_id -> jobs running now
+        self._running = {}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._ready = asyncio.Condition()
+        self._workers = []
+
+    async def submit(self, user_id: int, job) -> int:
+        """
+        Queue job() (a coroutine function) for a user and return how many jobs start
+        before it; 0 means it starts as soon as a worker is free
+        """
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.queue_limit:
+            raise QueueFull(f"user {user_id} has {len(queue)} jobs waiting")
+
+        position = self.position(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._turns.append(user_id)
+        queue.append((time.monotonic(), job))
+        async with self._ready:
+            self._ready.notify()
+        return position
+
+    def position(self, user_id: int, index: int = None) -> int:
+        """
+        Jobs that start before the user's index-th waiting job under round-robin; by
+        default the job the user would submit next. 0 when an idle worker can start it now.
+        """
+        queued = {other: len(queue) for other, queue in self._queues.items()}
+        turns = deque(self._turns)
+        if index is None:
+            index = queued.get(user_id, 0)
+        if user_id not in queued:
+            turns.append(user_id)
+        queued[user_id] = max(queued.get(user_id, 0), index + 1)
+
+        # Hand jobs to idle workers the way _next_job would; users held back only by
+        # per_user are passed over, so they do not count as ahead of anyone
+        running = dict(self._running)
+        for _ in range(self.concurrency - sum(running.values())):
+            for _ in range(len(turns)):
+                other = turns.popleft()
+                if running.get(other, 0) < self.per_user:
+                    break
+                turns.append(other)
+            else:
+                break
+            if other == user_id:
+                if index == 0:
+                    return 0
+                index -= 1
+            queued[other] -= 1
+            running[other] = running.get(other, 0) + 1
+            if queued[other]:
+                turns.append(other)
+
+        ahead = index
+        before_user = True
+        for other in turns:
+            if other == user_id:
+                before_user = False
+                continue
+            # Each earlier turn lets every other user start one job, plus one more for
+            # users whose turn comes before ours in the current round
+            ahead += min(queued[other], index + (1 if before_user else 0))
+        return ahead
+
+    def _next_job(self):
+        """Pop the first job of the first user in line who is below the per-user limit"""
+        for _ in range(len(self._turns)):
+            user_id = self._turns.popleft()
+            if self._running.get(user_id, 0) >= self.per_user:
+                self._turns.append(user_id)
+                continue
+            queue = self._queues[user_id]
+            submitted_at, job = queue.popleft()
+            if queue:
+                self._turns.append(user_id)
+            else:
+                del self._queues[user_id]
+            return user_id, submitted_at, job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._ready:
+                picked = self._next_job()
+                while picked is None:
+                    await self._ready.wait()
+                    picked = self._next_job()
+            user_id, submitted_at, job = picked
+
+            self._waits.append(time.monotonic() - submitted_at)
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            try:
+                await job()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Job for user {user_id} failed: {e}", exc_info=True)
+            finally:
+                self._running[user_id] -= 1
+                if not self._running[user_id]:
+                    del self._running[user_id]
+                # A per-user slot freed up: another worker may now take this user's next job
+                async with self._ready:
+                    self._ready.notify_all()
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            logger.info(f"🎬 Scheduler started ({self.concurrency} workers, {self.per_user} per user)")
+
+    async def stop(self) -> None:
+        """Cancel running jobs and drop queued ones"""
+        for worker in self._workers:
+            worker.cancel()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues.clear()
+        self._turns.clear()
+        self._running.clear()
+
+    def stats(self) -> dict:
+        return {
+            "running": sum(self._running.values()),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "users_waiting": len(self._queues),
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_p50": percentile(self._waits, 0.5),
+            "wait_p95": percentile(self._waits, 0.95)
+        }
+
+
+class Batcher:
+    """
+    Collects items per key and hands them to `flush(key, items)` once no item arrived for
+    `window` seconds or `max_size` items are waiting, whichever comes first
+    """
+
+    def __init__(self, flush, window: float = VIDEO_BATCH_WINDOW, max_size: int = MEDIA_GROUP_LIMIT):
+        self.flush = flush
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self.items = 0
+        # key -> (items, timer handle)
+        self._open = {}
+        self._tasks = set()
+
+    def is_open(self, key) -> bool:
+        return key in self._open
+
+    def add(self, key, item) -> None:
+        items, timer = self._open.pop(key, ([], None))
+        if timer is not None:
+            timer.cancel()
+        items.append(item)
+        if len(items) >= self.max_size:
+            self._flush(key, items)
+            return
+        timer = asyncio.get_running_loop().call_later(self.window, self._expire, key)
+        self._open[key] = (items, timer)
+
+    def _expire(self, key) -> None:
+        items, _ = self._open.pop(key, ([], None))
+        if items:
+            self._flush(key, items)
+
+    def _flush(self, key, items: list) -> None:
+        self.batches += 1
+        self.items += len(items)
+        task = asyncio.create_task(self.flush(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Batch flush failed: {task.exception()}")
+
+    async def stop(self) -> None:
+        """Drop open batches and wait for flushes already started"""
+        for _, timer in self._open.values():
+            timer.cancel()
+        self._open.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items, "open": len(self._open)}
+
+
+# Process-wide scheduler for video processing
+video_scheduler = FairScheduler()
@@ -0,0 +1,963 @@
+"""
+Storage Backends for Video Cover Bot
+MongoDB (Motor) and embedded SQLite implementations of the user store behind database.py
+
+Export / import between backends:
+    python storage.py export users.jsonl --backend mongo
+    python storage.py import users.jsonl --backend sqlite
+"""
+
+import os
+import json
+import asyncio
+import logging
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Backend selection: "mongo" or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo").strip().lower()
+
+# MongoDB Connection Setup
+MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "video_cover_bot")
+MONGO_POOL_SIZE = int(os.environ.get("MONGO_POOL_SIZE", "50"))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "5000"))
+
+# SQLite database file (created on first start)
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "video_cover_bot.db")
+
+# Cached cover results (see database.py) older than this are ignored and, on MongoDB, expired
+RESULT_TTL_DAYS = 30
+
+# Counters maintained by database.py; backends recount them from scratch via count_users()
+STATS_KEYS = ("total_users", "banned_users", "users_with_thumbnail", "unreachable_users")
+
+# Audience filters understood by iter_users()/count_audience():
+#   with_photo   - only users with a saved cover
+#   active_since - only users whose updated_at or verified_at is at or after this datetime
+#   reachable    - skip users marked unreachable (blocked the bot or deleted their account)
+AUDIENCE_KEYS = ("with_photo", "active_since", "reachable")
+
+
+class ChangeFeedUnsupported(Exception):
+    """The backend (or this deployment of it) cannot push document changes"""
+
+
+"""═══════════════════ DOCUMENT ENCODING ═══════════════════"""
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _json_object_hook(obj: dict):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def dumps_doc(doc: dict) -> str:
+    """Serialize a user document to JSON, keeping datetimes round-trippable"""
+    return json.dumps(doc, default=_json_default, ensure_ascii=False)
+
+
+def loads_doc(text: str) -> dict:
+    """Inverse of dumps_doc"""
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+def _project(doc: dict | None, fields) -> dict | None:
+    if doc is None or fields is None:
+        return doc
+    return {field: doc[field] for field in fields if field in doc}
+
+
+def _apply_update(doc: dict, set_fields: dict, unset_fields) -> dict:
+    doc = dict(doc)
+    doc.update(set_fields or {})
+    for field in unset_fields or ():
+        doc.pop(field, None)
+    return doc
+
+
+"""═══════════════════ INTERFACE ═══════════════════"""
+
+
+class Storage:
+    """User store interface; every method is a coroutine and raises on failure"""
+
+    name = "base"
+    label = "Storage"
+
+    async def connect(self) -> None:
+        """Open the backend and verify it is reachable"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+    async def ping(self) -> None:
+        raise NotImplementedError
+
+    async def ensure_schema(self) -> int:
+        """Apply pending migrations and return the schema version"""
+        raise NotImplementedError
+
+    async def index_stats(self) -> list[dict]:
+        """List indexes as {"name", "ops", "since"}; ops/since are None when unsupported"""
+        raise NotImplementedError
+
+    async def get_user(self, user_id: int, fields=None) -> dict | None:
+        raise NotImplementedError
+
+    async def update_user(self, user_id: int, set_fields: dict, unset_fields, upsert: bool, fields=None) -> dict | None:
+        """Atomically update one user and return the document as it was before"""
+        raise NotImplementedError
+
+    async def bulk_update_users(self, updates: list[tuple], unless: str = None) -> int:
+        """
+        Apply (user_id, set_fields, unset_fields, upsert) updates in one round trip and
+        return how many users were updated. With unless, users whose `unless` field is
+        already true are left alone and not counted.
+        """
+        raise NotImplementedError
+
+    async def count_users(self) -> dict:
+        """Count users for every key in STATS_KEYS"""
+        raise NotImplementedError
+
+    async def get_counters(self, name: str) -> dict | None:
+        raise NotImplementedError
+
+    async def inc_counters(self, name: str, delta: dict) -> None:
+        raise NotImplementedError
+
+    async def set_counters(self, name: str, values: dict) -> dict | None:
+        """Overwrite a counters document and return its previous values"""
+        raise NotImplementedError
+
+    def iter_users(self, fields=None, after_id=None, audience: dict = None, batch_size: int = 500):
+        """
+        Async iterator over user documents in user_id order, starting after after_id.
+        Fetched in keyset batches of batch_size, so memory stays flat and a page never
+        shifts when users are added mid-run. audience narrows the users (see AUDIENCE_KEYS).
+        """
+        raise NotImplementedError
+
+    async def count_audience(self, audience: dict = None) -> int:
+        """Number of users iter_users() yields for the same audience"""
+        raise NotImplementedError
+
+    def iter_banned_ids(self):
+        """Async iterator over the user_id of every banned user"""
+        raise NotImplementedError
+
+    def watch_bans(self):
+        """
+        Async iterator of (user_id, is_banned) for ban changes made by any writer.
+        Yields (None, None) once the feed is open and whenever the caller must reload
+        every ban. Raises ChangeFeedUnsupported when the backend cannot push changes.
+        """
+        raise ChangeFeedUnsupported(f"{self.label} has no change feed")
+
+    async def import_users(self, docs: list[dict]) -> int:
+        """Upsert exported user documents, merging into existing ones"""
+        raise NotImplementedError
+
+    async def save_job(self, job_id: str, fields: dict) -> None:
+        """Create a broadcast job or merge fields into it"""
+        raise NotImplementedError
+
+    async def get_job(self, job_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def claim_job(self, job_id: str, owner: str, stale_before: datetime) -> dict | None:
+        """
+        Atomically take ownership of a job that has no owner, is ours, or whose owner
+        last wrote it before stale_before; returns the job or None if someone else holds it
+        """
+        raise NotImplementedError
+
+    async def list_jobs(self, states=None, limit: int = 20) -> list[dict]:
+        """Newest broadcast jobs first, optionally only those in the given states"""
+        raise NotImplementedError
+
+    async def record_deliveries(self, job_id: str, results: list[tuple]) -> None:
+        """Store (user_id, outcome) delivery results for a job in one round trip"""
+        raise NotImplementedError
+
+    async def delivered_ids(self, job_id: str, after_id=None) -> set:
+        """User ids with a recorded delivery for a job, optionally only above after_id"""
+        raise NotImplementedError
+
+    async def delete_deliveries(self, job_id: str) -> None:
+        raise NotImplementedError
+
+    async def get_result(self, key: str) -> dict | None:
+        """Cached output of a cover job, or None if unknown or older than RESULT_TTL_DAYS"""
+        raise NotImplementedError
+
+    async def put_result(self, key: str, doc: dict) -> None:
+        raise NotImplementedError
+
+
+"""═══════════════════ MONGODB BACKEND ═══════════════════"""
+
+
+class MongoStorage(Storage):
+    """MongoDB backend built on Motor"""
+
+    name = "mongo"
+    label = "MongoDB"
+
+    def __init__(self, uri: str = MONGODB_URI, database: str = MONGODB_DATABASE,
+                 pool_size: int = MONGO_POOL_SIZE, timeout_ms: int = MONGO_TIMEOUT_MS):
+        self.uri = uri
+        self.database_name = database
+        self.pool_size = pool_size
+        self.timeout_ms = timeout_ms
+        self.client = None
+        self.db = None
+        self.users = None
+        self.meta = None
+        self.jobs = None
+        self.deliveries = None
+        self.results = None
+        # Ordered (version, description, coroutine); append new steps, never edit applied ones
+        self.migrations = [
+            (1, "dedupe user documents", self._migrate_dedupe_users),
+            (2, "create users indexes", self._migrate_user_indexes),
+            (3, "seed stats counters", self._migrate_seed_counters),
+            (4, "index broadcast deliveries", self._migrate_delivery_indexes),
+            (5, "expire cached results", self._migrate_result_ttl),
+        ]
+
+    async def connect(self) -> None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        if self.client is not None:
+            # Reconnect attempt: drop the old pool before building a new one
+            self.client.close()
+        self.client = AsyncIOMotorClient(
+            self.uri,
+            maxPoolSize=self.pool_size,
+            serverSelectionTimeoutMS=self.timeout_ms,
+            connectTimeoutMS=self.timeout_ms,
+            socketTimeoutMS=self.timeout_ms * 2
+        )
+        self.db = self.client[self.database_name]
+        self.users = self.db["users"]
+        self.meta = self.db["meta"]
+        self.jobs = self.db["broadcast_jobs"]
+        self.deliveries = self.db["broadcast_deliveries"]
+        self.results = self.db["video_results"]
+        # Test connection
+        await self.client.server_info()
+
+    async def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+
+    async def ping(self) -> None:
+        await self.client.admin.command("ping")
+
+    async def _migrate_dedupe_users(self) -> None:
+        """Collapse duplicate user documents left by concurrent upserts, keeping the newest"""
+        pipeline = [
+            {"$sort": {"updated_at": -1, "_id": -1}},
+            {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        removed = 0
+        async for group in self.users.aggregate(pipeline, allowDiskUse=True):
+            result = await self.users.delete_many({"_id": {"$in": group["ids"][1:]}})
+            removed += result.deleted_count
+        if removed:
+            logger.warning(f"⚠️ Removed {removed} duplicate user documents")
+
+    async def _migrate_user_indexes(self) -> None:
+        """Index every query the bot runs against the users collection"""
+        await self.users.create_index("user_id", unique=True, name="user_id_unique")
+        await self.users.create_index(
+            "is_banned",
+            partialFilterExpression={"is_banned": True},
+            name="is_banned_partial"
+        )
+        await self.users.create_index("photo_id", sparse=True, name="photo_id_sparse")
+
+    async def _migrate_seed_counters(self) -> None:
+        await self.set_counters("user_stats", await self.count_users())
+
+    async def _migrate_delivery_indexes(self) -> None:
+        await self.deliveries.create_index([("job_id", 1), ("user_id", 1)], unique=True, name="job_user_unique")
+        await self.jobs.create_index("state", name="state")
+
+    async def _migrate_result_ttl(self) -> None:
+        await self.results.create_index("at", expireAfterSeconds=RESULT_TTL_DAYS * 86400, name="at_ttl")
+
+    async def ensure_schema(self) -> int:
+        state = await self.meta.find_one({"_id": "schema"}) or {}
+        version = state.get("version", 0)
+
+        for target, description, migrate in self.migrations:
+            if target <= version:
+                continue
+            try:
+                await migrate()
+            except Exception as e:
+                logger.error(f"❌ Migration {target} ({description}) failed: {e}")
+                break
+            version = target
+            await self.meta.update_one(
+                {"_id": "schema"},
+                {"$set": {"version": version, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            logger.info(f"🗂 Applied migration {target}: {description}")
+
+        return version
+
+    async def index_stats(self) -> list[dict]:
+        stats = []
+        async for entry in self.users.aggregate([{"$indexStats": {}}]):
+            accesses = entry.get("accesses", {})
+            stats.append({
+                "name": entry.get("name"),
+                "ops": accesses.get("ops", 0),
+                "since": accesses.get("since")
+            })
+        return stats
+
+    @staticmethod
+    def _projection(fields) -> dict:
+        if fields is None:
+            return {"_id": 0}
+        return {"_id": 0, **{field: 1 for field in fields}}
+
+    @staticmethod
+    def _update_doc(set_fields: dict, unset_fields) -> dict:
+        update = {}
+        if set_fields:
+            update["$set"] = set_fields
+        if unset_fields:
+            update["$unset"] = {field: "" for field in unset_fields}
+        return update
+
+    async def get_user(self, user_id: int, fields=None) -> dict | None:
+        return await self.users.find_one({"user_id": user_id}, self._projection(fields))
+
+    async def update_user(self, user_id: int, set_fields: dict, unset_fields, upsert: bool, fields=None) -> dict | None:
+        from pymongo import ReturnDocument
+
+        return await self.users.find_one_and_update(
+            {"user_id": user_id},
+            self._update_doc(set_fields, unset_fields),
+            projection=self._projection(fields),
+            upsert=upsert,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def bulk_update_users(self, updates: list[tuple], unless: str = None) -> int:
+        from pymongo import UpdateOne
+
+        condition = {unless: {"$ne": True}} if unless else {}
+        requests = [
+            UpdateOne({"user_id": user_id, **condition}, self._update_doc(set_fields, unset_fields), upsert=upsert)
+            for user_id, set_fields, unset_fields, upsert in updates
+            if set_fields or unset_fields
+        ]
+        if not requests:
+            return 0
+        result = await self.users.bulk_write(requests, ordered=False)
+        return result.matched_count + result.upserted_count
+
+    async def count_users(self) -> dict:
+        return {
+            "total_users": await self.users.count_documents({}),
+            "banned_users": await self.users.count_documents({"is_banned": True}),
+            "users_with_thumbnail": await self.users.count_documents({"photo_id": {"$exists": True}}),
+            "unreachable_users": await self.users.count_documents({"unreachable": True})
+        }
+
+    async def get_counters(self, name: str) -> dict | None:
+        return await self.meta.find_one({"_id": name}, {"_id": 0})
+
+    async def inc_counters(self, name: str, delta: dict) -> None:
+        await self.meta.update_one({"_id": name}, {"$inc": delta}, upsert=True)
+
+    async def set_counters(self, name: str, values: dict) -> dict | None:
+        return await self.meta.find_one_and_update(
+            {"_id": name},
+            {"$set": {**values, "reconciled_at": datetime.now()}},
+            projection={"_id": 0},
+            upsert=True
+        )
+
+    @staticmethod
+    def _audience_query(audience: dict = None) -> dict:
+        audience = audience or {}
+        query = {}
+        if audience.get("with_photo"):
+            query["photo_id"] = {"$exists": True}
+        if audience.get("active_since") is not None:
+            since = audience["active_since"]
+            query["$or"] = [{"updated_at": {"$gte": since}}, {"verified_at": {"$gte": since}}]
+        if audience.get("reachable"):
+            query["unreachable"] = {"$ne": True}
+        return query
+
+    async def iter_users(self, fields=None, after_id=None, audience: dict = None, batch_size: int = 500):
+        query = self._audience_query(audience)
+        projection = self._projection(fields)
+        if fields is not None:
+            projection["user_id"] = 1
+        while True:
+            if after_id is not None:
+                query["user_id"] = {"$gt": after_id}
+            # Each page walks the user_id_unique index from the last id seen, so no cursor
+            # stays open for the length of a broadcast
+            cursor = self.users.find(query, projection).sort("user_id", 1).limit(batch_size)
+            docs = [doc async for doc in cursor]
+            for doc in docs:
+                yield _project(doc, fields)
+            if len(docs) < batch_size:
+                return
+            after_id = docs[-1]["user_id"]
+
+    async def count_audience(self, audience: dict = None) -> int:
+        return await self.users.count_documents(self._audience_query(audience))
+
+    async def iter_banned_ids(self):
+        # Served by the is_banned partial index
+        async for doc in self.users.find({"is_banned": True}, {"_id": 0, "user_id": 1}):
+            if "user_id" in doc:
+                yield doc["user_id"]
+
+    @staticmethod
+    def _ban_change(change: dict) -> tuple:
+        doc = change.get("fullDocument")
+        if change["operationType"] not in ("insert", "update", "replace") or doc is None:
+            # Deletes only carry the _id, so the caller reloads the whole set
+            return None, None
+        return doc.get("user_id"), bool(doc.get("is_banned", False))
+
+    async def watch_bans(self):
+        from pymongo.errors import OperationFailure
+
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace", "delete", "invalidate"]}},
+            {"updateDescription.updatedFields.is_banned": {"$exists": True}},
+            {"updateDescription.removedFields": "is_banned"},
+        ]}}]
+        try:
+            async with self.users.watch(pipeline, full_document="updateLookup") as stream:
+                # try_next() opens the cursor, so the reload below cannot miss a change
+                change = await stream.try_next()
+                yield None, None
+                if change is not None:
+                    yield self._ban_change(change)
+                async for change in stream:
+                    yield self._ban_change(change)
+        except OperationFailure as e:
+            # 40573: change streams need a replica set or sharded cluster
+            if e.code == 40573 or "replica set" in str(e):
+                raise ChangeFeedUnsupported(str(e)) from e
+            raise
+
+    async def import_users(self, docs: list[dict]) -> int:
+        updates = [(doc["user_id"], doc, (), True) for doc in docs if "user_id" in doc]
+        await self.bulk_update_users(updates)
+        return len(updates)
+
+    async def save_job(self, job_id: str, fields: dict) -> None:
+        await self.jobs.update_one({"_id": job_id}, {"$set": {**fields, "job_id": job_id}}, upsert=True)
+
+    async def get_job(self, job_id: str) -> dict | None:
+        return await self.jobs.find_one({"_id": job_id}, {"_id": 0})
+
+    async def claim_job(self, job_id: str, owner: str, stale_before: datetime) -> dict | None:
+        from pymongo import ReturnDocument
+
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, "$or": [
+                {"owner": None},
+                {"owner": owner},
+                {"updated_at": {"$lt": stale_before}},
+            ]},
+            {"$set": {"owner": owner, "updated_at": datetime.now()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def list_jobs(self, states=None, limit: int = 20) -> list[dict]:
+        query = {"state": {"$in": list(states)}} if states else {}
+        cursor = self.jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(limit)
+        return [doc async for doc in cursor]
+
+    async def record_deliveries(self, job_id: str, results: list[tuple]) -> None:
+        from pymongo import UpdateOne
+
+        now = datetime.now()
+        requests = [
+            UpdateOne({"job_id": job_id, "user_id": user_id}, {"$set": {"outcome": outcome, "at": now}}, upsert=True)
+            for user_id, outcome in results
+        ]
+        if requests:
+            await self.deliveries.bulk_write(requests, ordered=False)
+
+    async def delivered_ids(self, job_id: str, after_id=None) -> set:
+        query = {"job_id": job_id}
+        if after_id is not None:
+            query["user_id"] = {"$gt": after_id}
+        return {doc["user_id"] async for doc in self.deliveries.find(query, {"_id": 0, "user_id": 1})}
+
+    async def delete_deliveries(self, job_id: str) -> None:
+        await self.deliveries.delete_many({"job_id": job_id})
+
+    async def get_result(self, key: str) -> dict | None:
+        # The TTL monitor runs once a minute, so filter expired documents it has not removed yet
+        stale_before = datetime.now() - timedelta(days=RESULT_TTL_DAYS)
+        return await self.results.find_one({"_id": key, "at": {"$gte": stale_before}}, {"_id": 0, "at": 0})
+
+    async def put_result(self, key: str, doc: dict) -> None:
+        await self.results.replace_one({"_id": key}, {**doc, "at": datetime.now()}, upsert=True)
+
+
+"""═══════════════════ SQLITE BACKEND ═══════════════════"""
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite backend in WAL mode. Documents are stored as JSON so new fields need no
+    migrations; the bot's queries are served by partial expression indexes. All access goes
+    through one worker thread so the event loop never blocks on disk.
+    """
+
+    name = "sqlite"
+    label = "SQLite"
+
+    # Ordered (version, description, statements); append new steps, never edit applied ones
+    MIGRATIONS = [
+        (1, "create users and meta tables", [
+            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, doc TEXT NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, doc TEXT NOT NULL)",
+        ]),
+        (2, "index banned and covered users", [
+            "CREATE INDEX IF NOT EXISTS users_banned ON users(user_id) "
+            "WHERE json_extract(doc, '$.is_banned') = 1",
+            "CREATE INDEX IF NOT EXISTS users_with_photo ON users(user_id) "
+            "WHERE json_type(doc, '$.photo_id') IS NOT NULL",
+        ]),
+        (3, "create broadcast job tables", [
+            "CREATE TABLE IF NOT EXISTS broadcast_jobs (job_id TEXT PRIMARY KEY, doc TEXT NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS broadcast_deliveries ("
+            "job_id TEXT NOT NULL, user_id INTEGER NOT NULL, outcome TEXT NOT NULL, at TEXT, "
+            "PRIMARY KEY (job_id, user_id)) WITHOUT ROWID",
+        ]),
+        (4, "create cached results table", [
+            "CREATE TABLE IF NOT EXISTS video_results (key TEXT PRIMARY KEY, doc TEXT NOT NULL, at TEXT NOT NULL) "
+            "WITHOUT ROWID",
+        ]),
+    ]
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self) -> None:
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+
+    async def connect(self) -> None:
+        await self._run(self._open)
+
+    async def close(self) -> None:
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+        self._executor.shutdown(wait=False)
+
+    async def ping(self) -> None:
+        await self._run(self.conn.execute, "SELECT 1")
+
+    def _ensure_schema(self) -> int:
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, description, statements in self.MIGRATIONS:
+            if target <= version:
+                continue
+            with self._transaction():
+                for statement in statements:
+                    self.conn.execute(statement)
+                self.conn.execute(f"PRAGMA user_version = {int(target)}")
+            version = target
+            logger.info(f"🗂 Applied migration {target}: {description}")
+        return version
+
+    async def ensure_schema(self) -> int:
+        return await self._run(self._ensure_schema)
+
+    def _index_stats(self) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'users'"
+        ).fetchall()
+        return [{"name": name, "ops": None, "since": None} for (name,) in rows]
+
+    async def index_stats(self) -> list[dict]:
+        return await self._run(self._index_stats)
+
+    def _transaction(self):
+        return _SQLiteTransaction(self.conn)
+
+    def _load(self, user_id: int) -> dict | None:
+        row = self.conn.execute("SELECT doc FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return loads_doc(row[0]) if row else None
+
+    def _store(self, user_id: int, doc: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO users (user_id, doc) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET doc = excluded.doc",
+            (user_id, dumps_doc(doc))
+        )
+
+    def _update(self, user_id: int, set_fields: dict, unset_fields, upsert: bool) -> dict | None:
+        before = self._load(user_id)
+        if before is None and not upsert:
+            return None
+        after = _apply_update(before or {"user_id": user_id}, set_fields, unset_fields)
+        self._store(user_id, after)
+        return before
+
+    def _update_user(self, user_id, set_fields, unset_fields, upsert, fields):
+        with self._transaction():
+            return _project(self._update(user_id, set_fields, unset_fields, upsert), fields)
+
+    async def get_user(self, user_id: int, fields=None) -> dict | None:
+        return _project(await self._run(self._load, user_id), fields)
+
+    async def update_user(self, user_id: int, set_fields: dict, unset_fields, upsert: bool, fields=None) -> dict | None:
+        return await self._run(self._update_user, user_id, set_fields, unset_fields, upsert, fields)
+
+    def _bulk_update(self, updates: list[tuple], unless: str = None) -> int:
+        updated = 0
+        with self._transaction():
+            for user_id, set_fields, unset_fields, upsert in updates:
+                if unless and (self._load(user_id) or {}).get(unless) is True:
+                    continue
+                if self._update(user_id, set_fields, unset_fields, upsert) is not None or upsert:
+                    updated += 1
+        return updated
+
+    async def bulk_update_users(self, updates: list[tuple], unless: str = None) -> int:
+        if not updates:
+            return 0
+        return await self._run(self._bulk_update, updates, unless)
+
+    def _count_users(self) -> dict:
+        def count(where: str = "") -> int:
+            return self.conn.execute(f"SELECT COUNT(*) FROM users {where}").fetchone()[0]
+
+        return {
+            "total_users": count(),
+            "banned_users": count("WHERE json_extract(doc, '$.is_banned') = 1"),
+            "users_with_thumbnail": count("WHERE json_type(doc, '$.photo_id') IS NOT NULL"),
+            "unreachable_users": count("WHERE json_extract(doc, '$.unreachable') = 1")
+        }
+
+    async def count_users(self) -> dict:
+        return await self._run(self._count_users)
+
+    def _get_counters(self, name: str) -> dict | None:
+        row = self.conn.execute("SELECT doc FROM meta WHERE key = ?", (name,)).fetchone()
+        return loads_doc(row[0]) if row else None
+
+    def _put_counters(self, name: str, values: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO meta (key, doc) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET doc = excluded.doc",
+            (name, dumps_doc(values))
+        )
+
+    def _inc_counters(self, name: str, delta: dict) -> None:
+        with self._transaction():
+            values = self._get_counters(name) or {}
+            for key, value in delta.items():
+                values[key] = values.get(key, 0) + value
+            self._put_counters(name, values)
+
+    def _set_counters(self, name: str, values: dict) -> dict | None:
+        with self._transaction():
+            previous = self._get_counters(name)
+            self._put_counters(name, {**(previous or {}), **values, "reconciled_at": datetime.now()})
+            return previous
+
+    async def get_counters(self, name: str) -> dict | None:
+        return await self._run(self._get_counters, name)
+
+    async def inc_counters(self, name: str, delta: dict) -> None:
+        await self._run(self._inc_counters, name, delta)
+
+    async def set_counters(self, name: str, values: dict) -> dict | None:
+        return await self._run(self._set_counters, name, values)
+
+    @staticmethod
+    def _audience_where(audience: dict = None) -> tuple[list[str], list]:
+        audience = audience or {}
+        clauses, params = [], []
+        if audience.get("with_photo"):
+            clauses.append("json_type(doc, '$.photo_id') IS NOT NULL")
+        if audience.get("active_since") is not None:
+            # Datetimes are stored as ISO strings, which sort chronologically
+            since = audience["active_since"].isoformat()
+            clauses.append(
+                "(json_extract(doc, '$.updated_at.\"$date\"') >= ? "
+                "OR json_extract(doc, '$.verified_at.\"$date\"') >= ?)"
+            )
+            params += [since, since]
+        if audience.get("reachable"):
+            clauses.append("json_extract(doc, '$.unreachable') IS NOT 1")
+        return clauses, params
+
+    def _fetch_batch(self, after_id, limit: int, audience: dict = None) -> list[tuple]:
+        clauses, params = self._audience_where(audience)
+        where = " AND ".join(["user_id > ?"] + clauses)
+        return self.conn.execute(
+            f"SELECT user_id, doc FROM users WHERE {where} ORDER BY user_id LIMIT ?",
+            (after_id, *params, limit)
+        ).fetchall()
+
+    async def iter_users(self, fields=None, after_id=None, audience: dict = None, batch_size: int = 500):
+        if after_id is None:
+            after_id = -(2 ** 63)
+        while True:
+            rows = await self._run(self._fetch_batch, after_id, batch_size, audience)
+            if not rows:
+                return
+            for user_id, doc in rows:
+                yield _project(loads_doc(doc), fields)
+            after_id = rows[-1][0]
+
+    def _count_audience(self, audience: dict = None) -> int:
+        clauses, params = self._audience_where(audience)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.conn.execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+
+    async def count_audience(self, audience: dict = None) -> int:
+        return await self._run(self._count_audience, audience)
+
+    def _banned_ids(self) -> list[int]:
+        rows = self.conn.execute(
+            "SELECT user_id FROM users WHERE json_extract(doc, '$.is_banned') = 1"
+        ).fetchall()
+        return [user_id for (user_id,) in rows]
+
+    async def iter_banned_ids(self):
+        for user_id in await self._run(self._banned_ids):
+            yield user_id
+
+    def _import(self, docs: list[dict]) -> int:
+        with self._transaction():
+            for doc in docs:
+                self._update(doc["user_id"], doc, (), True)
+        return len(docs)
+
+    async def import_users(self, docs: list[dict]) -> int:
+        docs = [doc for doc in docs if "user_id" in doc]
+        return await self._run(self._import, docs)
+
+    def _save_job(self, job_id: str, fields: dict) -> None:
+        with self._transaction():
+            row = self.conn.execute("SELECT doc FROM broadcast_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            doc = {**(loads_doc(row[0]) if row else {}), **fields, "job_id": job_id}
+            self.conn.execute(
+                "INSERT INTO broadcast_jobs (job_id, doc) VALUES (?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET doc = excluded.doc",
+                (job_id, dumps_doc(doc))
+            )
+
+    async def save_job(self, job_id: str, fields: dict) -> None:
+        await self._run(self._save_job, job_id, fields)
+
+    def _get_job(self, job_id: str) -> dict | None:
+        row = self.conn.execute("SELECT doc FROM broadcast_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return loads_doc(row[0]) if row else None
+
+    async def get_job(self, job_id: str) -> dict | None:
+        return await self._run(self._get_job, job_id)
+
+    def _claim_job(self, job_id: str, owner: str, stale_before: datetime) -> dict | None:
+        with self._transaction():
+            job = self._get_job(job_id)
+            if job is None:
+                return None
+            holder, updated_at = job.get("owner"), job.get("updated_at")
+            if holder not in (None, owner) and updated_at is not None and updated_at >= stale_before:
+                return None
+            job.update({"owner": owner, "updated_at": datetime.now()})
+            self.conn.execute("UPDATE broadcast_jobs SET doc = ? WHERE job_id = ?", (dumps_doc(job), job_id))
+            return job
+
+    async def claim_job(self, job_id: str, owner: str, stale_before: datetime) -> dict | None:
+        return await self._run(self._claim_job, job_id, owner, stale_before)
+
+    def _list_jobs(self, states, limit: int) -> list[dict]:
+        jobs = [loads_doc(doc) for (doc,) in self.conn.execute("SELECT doc FROM broadcast_jobs").fetchall()]
+        if states:
+            jobs = [job for job in jobs if job.get("state") in states]
+        jobs.sort(key=lambda job: job.get("created_at") or datetime.min, reverse=True)
+        return jobs[:limit]
+
+    async def list_jobs(self, states=None, limit: int = 20) -> list[dict]:
+        return await self._run(self._list_jobs, states, limit)
+
+    def _record_deliveries(self, job_id: str, results: list[tuple]) -> None:
+        now = datetime.now().isoformat()
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT INTO broadcast_deliveries (job_id, user_id, outcome, at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(job_id, user_id) DO UPDATE SET outcome = excluded.outcome, at = excluded.at",
+                [(job_id, user_id, outcome, now) for user_id, outcome in results]
+            )
+
+    async def record_deliveries(self, job_id: str, results: list[tuple]) -> None:
+        if results:
+            await self._run(self._record_deliveries, job_id, results)
+
+    def _delivered_ids(self, job_id: str, after_id) -> set:
+        rows = self.conn.execute(
+            "SELECT user_id FROM broadcast_deliveries WHERE job_id = ? AND user_id > ?",
+            (job_id, -(2 ** 63) if after_id is None else after_id)
+        ).fetchall()
+        return {user_id for (user_id,) in rows}
+
+    async def delivered_ids(self, job_id: str, after_id=None) -> set:
+        return await self._run(self._delivered_ids, job_id, after_id)
+
+    def _delete_deliveries(self, job_id: str) -> None:
+        with self._transaction():
+            self.conn.execute("DELETE FROM broadcast_deliveries WHERE job_id = ?", (job_id,))
+
+    async def delete_deliveries(self, job_id: str) -> None:
+        await self._run(self._delete_deliveries, job_id)
+
+    def _get_result(self, key: str) -> dict | None:
+        stale_before = (datetime.now() - timedelta(days=RESULT_TTL_DAYS)).isoformat()
+        row = self.conn.execute(
+            "SELECT doc FROM video_results WHERE key = ? AND at >= ?", (key, stale_before)
+        ).fetchone()
+        return loads_doc(row[0]) if row else None
+
+    async def get_result(self, key: str) -> dict | None:
+        return await self._run(self._get_result, key)
+
+    def _put_result(self, key: str, doc: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO video_results (key, doc, at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET doc = excluded.doc, at = excluded.at",
+            (key, dumps_doc(doc), datetime.now().isoformat())
+        )
+
+    async def put_result(self, key: str, doc: dict) -> None:
+        await self._run(self._put_result, key, doc)
+
+
+class _SQLiteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block on an autocommit connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_storage(backend: str = None) -> Storage:
+    """Build the configured storage backend; settings are read from the environment at call time"""
+    backend = (backend or os.environ.get("STORAGE_BACKEND", STORAGE_BACKEND)).strip().lower()
+    if backend == "sqlite":
+        return SQLiteStorage(os.environ.get("SQLITE_PATH", SQLITE_PATH))
+    if backend == "mongo":
+        return MongoStorage(
+            os.environ.get("MONGODB_URI", MONGODB_URI),
+            os.environ.get("MONGODB_DATABASE", MONGODB_DATABASE),
+            int(os.environ.get("MONGO_POOL_SIZE", MONGO_POOL_SIZE)),
+            int(os.environ.get("MONGO_TIMEOUT_MS", MONGO_TIMEOUT_MS))
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (expected 'mongo' or 'sqlite')")
+
+
+"""═══════════════════ EXPORT / IMPORT ═══════════════════"""
+
+
+async def export_users(storage: Storage, path: str) -> int:
+    """Write every user document to a JSON-lines file"""
+    count = 0
+    with open(path, "w", encoding="utf-8") as fh:
+        async for doc in storage.iter_users():
+            fh.write(dumps_doc(doc) + "\n")
+            count += 1
+    return count
+
+
+async def import_users(storage: Storage, path: str, batch_size: int = 500) -> int:
+    """Load a JSON-lines export into a backend and recount its stats counters"""
+    count = 0
+    batch = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                batch.append(loads_doc(line))
+            if len(batch) >= batch_size:
+                count += await storage.import_users(batch)
+                batch = []
+    if batch:
+        count += await storage.import_users(batch)
+    await storage.set_counters("user_stats", await storage.count_users())
+    return count
+
+
+async def _main(args) -> None:
+    storage = create_storage(args.backend)
+    await storage.connect()
+    try:
+        await storage.ensure_schema()
+        if args.action == "export":
+            count = await export_users(storage, args.path)
+            logger.info(f"📤 Exported {count} users from {storage.label} to {args.path}")
+        else:
+            count = await import_users(storage, args.path)
+            logger.info(f"📥 Imported {count} users from {args.path} into {storage.label}")
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    try:
+        import config  # noqa: F401 - loads config.env into the environment
+    except Exception:
+        pass
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Move user data between storage backends")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path", help="JSON-lines file to write or read")
+    parser.add_argument("--backend", choices=["mongo", "sqlite"], default=None)
+    asyncio.run(_main(parser.parse_args()))
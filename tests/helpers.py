@@ -0,0 +1,36 @@
+import os
+import asyncio
+import tempfile
+from unittest import mock
+
+import database
+
+
+async def open_test_db(test, **settings) -> None:
+    """
+    Point the database module at a fresh SQLite file for one test. Module state that
+    outlives close_db() (schema flag, ban set, caches, loop-bound primitives) is reset
+    too; `settings` patch database module attributes such as WRITE_MODE.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    patchers = [
+        mock.patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": os.path.join(tmp.name, "bot.db")}),
+        mock.patch.object(database, "_schema_ready", False),
+        mock.patch.object(database, "_bans_loaded", False),
+        mock.patch.object(database, "_banned_ids", set()),
+        mock.patch.object(database, "_pending_writes", {}),
+        mock.patch.object(database, "_pending_stats", {}),
+        mock.patch.object(database, "_health_wakeup", asyncio.Event()),
+        mock.patch.object(database, "_flush_lock", asyncio.Lock()),
+        mock.patch.object(database, "_flush_wakeup", asyncio.Event()),
+    ]
+    patchers += [mock.patch.object(database, name, value) for name, value in settings.items()]
+    for patcher in patchers:
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    database.user_cache.clear()
+    test.addCleanup(database.user_cache.clear)
+
+    test.assertTrue(await database.init_db())
+    test.addAsyncCleanup(database.close_db)
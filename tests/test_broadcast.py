@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import database
+import broadcast
+from invalidation import bus
+from ratelimit import TokenBucket
+from helpers import open_test_db
+
+USERS = range(1, 101)
+
+
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+    """Jobs interrupted mid-run resume elsewhere without messaging anyone twice"""
+
+    async def asyncSetUp(self):
+        for name, value in {
+            "BROADCAST_CHECKPOINT_BATCH": 7,
+            "BROADCAST_CHECKPOINT_INTERVAL": 0.05,
+            "BROADCAST_JOB_LEASE": 0.2,
+            "limiter": TokenBucket(2000, 100),
+        }.items():
+            patcher = mock.patch.object(broadcast, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        await open_test_db(self)
+        for user_id in USERS:
+            await database.save_thumbnail(user_id, f"photo{user_id}")
+        self.received = []
+
+    async def send(self, user_id: int) -> None:
+        await asyncio.sleep(0.002)
+        self.received.append(user_id)
+
+    async def interrupt(self, doc: dict, after: int) -> dict:
+        """Run a job until `after` users got the message, then stop it like a shutdown"""
+        broadcast.spawn_job(broadcast.BroadcastJob(doc, self.send).run())
+        while len(self.received) < after:
+            await asyncio.sleep(0.005)
+        await broadcast.stop_jobs()
+        return await database.get_broadcast_job(doc["job_id"])
+
+    async def resume_as_new_worker(self) -> None:
+        started = []
+        with mock.patch.object(bus, "origin", "new-worker"):
+            resumer = asyncio.create_task(broadcast.resume_jobs_loop(
+                lambda doc: started.append(broadcast.spawn_job(broadcast.BroadcastJob(doc, self.send).run()))
+            ))
+            for _ in range(100):
+                if started:
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.gather(*started)
+            resumer.cancel()
+            await asyncio.gather(resumer, return_exceptions=True)
+        self.assertEqual(len(started), 1)
+
+    async def test_stop_checkpoints_and_releases(self):
+        doc = await broadcast.create_job("hello", 1, 1, 1, len(USERS))
+        saved = await self.interrupt(doc, 30)
+
+        self.assertEqual(saved["state"], "running")
+        self.assertIsNone(saved["owner"])
+        self.assertEqual(saved["sent"], len(self.received))
+        self.assertLessEqual(saved["checkpoint"], max(self.received))
+
+        await self.resume_as_new_worker()
+        saved = await database.get_broadcast_job(doc["job_id"])
+        self.assertEqual(saved["state"], "completed")
+        self.assertEqual(saved["sent"], len(USERS))
+        self.assertEqual(sorted(self.received), list(USERS))
+
+    async def test_crash_resumes_after_lease_without_duplicates(self):
+        doc = await broadcast.create_job("hello", 1, 1, 1, len(USERS))
+        saved = await self.interrupt(doc, 40)
+        # A crashed worker never wrote its last checkpoint and still holds the job
+        await database.save_broadcast_job(doc["job_id"], {"checkpoint": None, "owner": "dead-worker"})
+
+        claimed = await database.claim_broadcast_job(doc["job_id"], "new-worker", 30)
+        self.assertIsNone(claimed, "job taken over before its lease expired")
+
+        await asyncio.sleep(broadcast.BROADCAST_JOB_LEASE)
+        await self.resume_as_new_worker()
+        saved = await database.get_broadcast_job(doc["job_id"])
+        self.assertEqual(saved["state"], "completed")
+        # Recorded deliveries are skipped even behind the checkpoint
+        self.assertEqual(len(self.received), len(set(self.received)))
+        self.assertEqual(sorted(self.received), list(USERS))
+
+    async def test_stop_during_delivery_write_keeps_results(self):
+        # Slow writes make the shutdown land while a batch of results is being stored
+        record = database.storage.record_deliveries
+
+        async def slow_record(job_id, results):
+            await asyncio.sleep(0.05)
+            await record(job_id, results)
+
+        doc = await broadcast.create_job("hello", 1, 1, 1, len(USERS))
+        with mock.patch.object(database.storage, "record_deliveries", slow_record):
+            await self.interrupt(doc, 40)
+        await database.save_broadcast_job(doc["job_id"], {"checkpoint": None})
+
+        await self.resume_as_new_worker()
+        self.assertEqual(len(self.received), len(set(self.received)))
+        self.assertEqual(sorted(self.received), list(USERS))
+
+
+if __name__ == "__main__":
+    unittest.main()
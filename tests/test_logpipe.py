@@ -0,0 +1,82 @@
+import re
+import time
+import asyncio
+import unittest
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+from logpipe import LogPipeline
+
+
+class FloodedBot:
+    """Answers the first send with RetryAfter, then records every message and its time"""
+
+    def __init__(self, retry_after=0):
+        self.retry_after = retry_after
+        self.messages = []
+        self.sent_at = []
+        self.flooded = False
+        self.flooded_at = None
+
+    async def send_message(self, chat_id, text, parse_mode):
+        if not self.flooded:
+            self.flooded = True
+            self.flooded_at = time.monotonic()
+            raise RetryAfter(self.retry_after)
+        self.messages.append(text)
+        self.sent_at.append(time.monotonic())
+
+
+async def wait_drained(pipeline: LogPipeline, timeout: float) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if not pipeline.stats()["queued"]:
+            return
+        await asyncio.sleep(0.01)
+
+
+class RetryAfterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_flood_limited_digest_is_requeued_once(self):
+        pipeline = LogPipeline(-100, rate_per_minute=6000, burst=100)
+        # ~1000 characters each, so one digest holds only a few of the 40 events
+        events = [f"event {i:02d} " + "x" * 1000 for i in range(40)]
+        for i, event in enumerate(events):
+            pipeline.post(event, important=(i % 10 == 0))
+
+        text, popped = pipeline._next_digest()
+        self.assertLess(len(popped[0]) + len(popped[1]), 40)
+        pipeline._restore(popped)
+        self.assertEqual(pipeline.stats()["queued"], 40)
+
+        bot = FloodedBot()
+        pipeline.start(bot)
+        await wait_drained(pipeline, 1)
+        await pipeline.stop()
+
+        delivered = [m for text in bot.messages for m in re.findall(r"event \d\d", text)]
+        self.assertTrue(bot.flooded)
+        self.assertEqual(sorted(delivered), sorted(e[:8] for e in events))
+        # Admin events still go out ahead of routine ones
+        self.assertEqual(delivered[:4], ["event 00", "event 10", "event 20", "event 30"])
+
+    async def test_sends_after_a_pause_are_paced(self):
+        # 10 messages a second, at most 2 back to back
+        pipeline = LogPipeline(-100, rate_per_minute=600, burst=2)
+        # Too long to share a digest: one message per event
+        for i in range(5):
+            pipeline.post(f"event {i} " + "x" * 3000)
+
+        bot = FloodedBot(retry_after=timedelta(seconds=0.3))
+        pipeline.start(bot)
+        await wait_drained(pipeline, 3)
+        await pipeline.stop()
+
+        self.assertEqual(len(bot.messages), 5)
+        self.assertGreaterEqual(bot.sent_at[0] - bot.flooded_at, 0.3)
+        # After the pause the bucket starts empty: no burst, one message per 1/rate
+        gaps = [b - a for a, b in zip(bot.sent_at, bot.sent_at[1:])]
+        self.assertTrue(all(gap >= 0.1 - 0.02 for gap in gaps), gaps)
+
+
+if __name__ == "__main__":
+    unittest.main()
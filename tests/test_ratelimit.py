@@ -0,0 +1,52 @@
+import time
+import unittest
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+from ratelimit import TokenBucket, retry_after_seconds, DEFAULT_RETRY_AFTER
+
+
+async def drain(bucket: TokenBucket, count: int) -> list:
+    """Acquire `count` tokens and return when each one was handed out"""
+    times = []
+    for _ in range(count):
+        await bucket.acquire()
+        times.append(time.monotonic())
+    return times
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, capacity=5)
+        start = time.monotonic()
+        times = await drain(bucket, 10)
+        self.assertLess(times[4] - start, 0.05)
+        # The five tokens past the burst are refilled at 20/s
+        self.assertGreaterEqual(times[9] - start, 5 / 20 - 0.02)
+
+    async def test_pause_restarts_from_empty(self):
+        bucket = TokenBucket(rate=10, capacity=10)
+        await drain(bucket, 10)
+        bucket.pause(0.3)
+        self.assertGreater(bucket.paused_for, 0.2)
+
+        start = time.monotonic()
+        times = await drain(bucket, 3)
+        # Nothing during the pause, then one token per 1/rate instead of a full burst
+        self.assertGreaterEqual(times[0] - start, 0.3 + 0.1 - 0.02)
+        self.assertGreaterEqual(times[2] - times[0], 2 / 10 - 0.02)
+
+
+class RetryAfterSecondsTest(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(retry_after_seconds(RetryAfter(5)), 5.0)
+        self.assertEqual(retry_after_seconds(RetryAfter(timedelta(seconds=2))), 2.0)
+        self.assertEqual(retry_after_seconds(RetryAfter(0)), 0.0)
+
+    def test_missing_value_uses_default(self):
+        self.assertEqual(retry_after_seconds(Exception()), float(DEFAULT_RETRY_AFTER))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+import database
+from helpers import open_test_db
+
+
+class MarkUnreachableTest(unittest.IsolatedAsyncioTestCase):
+    write_mode = "sync"
+
+    async def asyncSetUp(self):
+        await open_test_db(self, WRITE_MODE=self.write_mode, WRITE_FLUSH_INTERVAL=3600)
+        for user_id in (1, 2, 3):
+            await database.save_thumbnail(user_id, f"photo{user_id}")
+
+    async def counters(self) -> tuple:
+        await database.flush_writes()
+        counters = await database.storage.get_counters("user_stats")
+        counted = await database.storage.count_users()
+        return counters["unreachable_users"], counted["unreachable_users"]
+
+    async def test_counter_only_counts_newly_flagged_users(self):
+        self.assertEqual(await database.mark_unreachable([(1, "blocked")]), 1)
+        # User 1 is already flagged and user 99 has no record: only user 2 is new
+        flagged = await database.mark_unreachable([(1, "blocked"), (2, "deactivated"), (99, "chat_not_found")])
+        self.assertEqual(flagged, 1)
+        self.assertEqual(await self.counters(), (2, 2))
+        self.assertIsNone(await database.storage.get_user(99))
+
+    async def test_reachable_again(self):
+        await database.mark_unreachable([(3, "blocked")])
+        self.assertTrue(await database.mark_reachable(3))
+        self.assertEqual(await self.counters(), (0, 0))
+        self.assertFalse((await database.get_user_profile(3))["unreachable"])
+
+
+class MarkUnreachableWriteBehindTest(MarkUnreachableTest):
+    write_mode = "behind"
+
+
+if __name__ == "__main__":
+    unittest.main()
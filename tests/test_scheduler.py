@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from scheduler import FairScheduler, QueueFull
+
+
+class Jobs:
+    """Jobs that record their start order and block until released"""
+
+    def __init__(self):
+        self.started = []
+        self.gate = asyncio.Event()
+
+    def job(self, name):
+        async def run():
+            self.started.append(name)
+            await self.gate.wait()
+        return run
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.jobs = Jobs()
+
+    async def start(self, **kwargs) -> FairScheduler:
+        scheduler = FairScheduler(**kwargs)
+        scheduler.start()
+        self.addAsyncCleanup(scheduler.stop)
+        return scheduler
+
+    async def settle(self):
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def test_round_robin_between_users(self):
+        scheduler = await self.start(concurrency=1, per_user=1)
+        # Occupy the only worker, then queue a burst for "a" and one job each for "b", "c"
+        await scheduler.submit("x", self.jobs.job("x"))
+        await self.settle()
+        for i in range(3):
+            await scheduler.submit("a", self.jobs.job(f"a{i}"))
+        await scheduler.submit("b", self.jobs.job("b0"))
+        await scheduler.submit("c", self.jobs.job("c0"))
+
+        # Release jobs one at a time and watch who goes next
+        for _ in range(5):
+            self.jobs.gate.set()
+            await self.settle()
+            self.jobs.gate.clear()
+        self.jobs.gate.set()
+        await self.settle()
+        self.assertEqual(self.jobs.started, ["x", "a0", "b0", "c0", "a1", "a2"])
+
+    async def test_position_is_zero_when_a_worker_is_idle(self):
+        scheduler = await self.start(concurrency=2, per_user=1)
+        for i in range(5):
+            await scheduler.submit("a", self.jobs.job(f"a{i}"))
+        await self.settle()
+
+        # "a" is held back by per_user alone; the second worker is free for "b"
+        self.assertEqual(scheduler.position("b"), 0)
+        self.assertEqual(await scheduler.submit("b", self.jobs.job("b0")), 0)
+        await self.settle()
+        self.assertIn("b0", self.jobs.started)
+
+        # Both workers busy now: "c" waits for one of "a"'s queued jobs
+        self.assertEqual(scheduler.position("c"), 1)
+
+    async def test_position_matches_start_order(self):
+        scheduler = await self.start(concurrency=1, per_user=1)
+        await scheduler.submit("x", self.jobs.job("x"))
+        await self.settle()
+        for i in range(3):
+            await scheduler.submit("a", self.jobs.job(f"a{i}"))
+        expected = await scheduler.submit("b", self.jobs.job("b0"))
+
+        while "b0" not in self.jobs.started:
+            self.jobs.gate.set()
+            await self.settle()
+            self.jobs.gate.clear()
+        self.jobs.gate.set()
+        # Jobs that started after "x" and before "b0"
+        self.assertEqual(self.jobs.started.index("b0") - 1, expected)
+
+    async def test_queue_limit_per_user(self):
+        scheduler = await self.start(concurrency=1, per_user=1, queue_limit=2)
+        await scheduler.submit("x", self.jobs.job("x"))
+        await self.settle()
+        await scheduler.submit("a", self.jobs.job("a0"))
+        await scheduler.submit("a", self.jobs.job("a1"))
+        with self.assertRaises(QueueFull):
+            await scheduler.submit("a", self.jobs.job("a2"))
+        # Other users are not affected
+        await scheduler.submit("b", self.jobs.job("b0"))
+        self.assertEqual(scheduler.stats()["queued"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
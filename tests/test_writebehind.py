@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+import database
+from helpers import open_test_db
+
+
+class WriteBehindTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Only explicit flush_writes() calls reach the database
+        await open_test_db(self, WRITE_MODE="behind", WRITE_FLUSH_INTERVAL=3600)
+
+    async def stored(self, user_id: int) -> dict | None:
+        return await database.storage.get_user(user_id, database.PROFILE_FIELDS)
+
+    async def test_queued_writes_are_read_back_and_flushed(self):
+        await database.save_thumbnail(1, "photo1")
+
+        self.assertIsNone(await self.stored(1))
+        self.assertEqual((await database.get_user_profile(1))["photo_id"], "photo1")
+
+        self.assertEqual(await database.flush_writes(), 1)
+        self.assertEqual((await self.stored(1))["photo_id"], "photo1")
+        self.assertEqual((await database.get_stats())["users_with_thumbnail"], 1)
+        counters = await database.storage.get_counters("user_stats")
+        self.assertEqual((counters["total_users"], counters["users_with_thumbnail"]), (1, 1))
+
+    async def test_failed_flush_is_requeued_under_newer_updates(self):
+        await database.save_thumbnail(1, "old")
+        await database.save_thumbnail(2, "photo2")
+
+        failing = mock.AsyncMock(side_effect=ConnectionError("database down"))
+        with mock.patch.object(database.storage, "bulk_update_users", failing):
+            self.assertEqual(await database.flush_writes(), 0)
+        self.assertEqual(set(database._pending_writes), {1, 2})
+
+        # Updates queued after the failure win over the requeued batch
+        await database.delete_thumbnail(1)
+        await database.ban_user(2, "spam")
+        self.assertEqual(await database.flush_writes(), 2)
+        self.assertFalse(database._pending_writes)
+
+        first, second = await self.stored(1), await self.stored(2)
+        self.assertIsNotNone(first)
+        self.assertNotIn("photo_id", first)
+        self.assertEqual((second["photo_id"], second["is_banned"]), ("photo2", True))
+        counters = await database.storage.get_counters("user_stats")
+        self.assertEqual((counters["total_users"], counters["users_with_thumbnail"]), (2, 1))
+
+
+class RequeueTest(unittest.TestCase):
+    def test_newer_fields_win(self):
+        older = {"set": {"photo_id": "a", "ban_reason": "x"}, "unset": {"verified_at"}, "upsert": True}
+        newer = {"set": {"verified_at": 1}, "unset": {"photo_id"}, "upsert": False}
+        with mock.patch.object(database, "_pending_writes", {7: newer}), \
+                mock.patch.object(database, "_pending_stats", {"total_users": 1}):
+            database._requeue({7: older}, {"total_users": 2})
+            self.assertEqual(database._pending_writes[7], {
+                "set": {"ban_reason": "x", "verified_at": 1},
+                "unset": {"photo_id"},
+                "upsert": True
+            })
+            self.assertEqual(database._pending_stats, {"total_users": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()